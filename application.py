@@ -9,8 +9,25 @@ def create_app(**config_overrides):
     
     app.config.update(config_overrides)
     
+    # opt-in per-request query counts; nothing is hooked into pymongo otherwise
+    if app.config.get('QUERY_STATS'):
+        from utilities.querystats import query_instrumentation
+        query_instrumentation.init_app(app)
+    
     db.init_app(app)
     
+    from relationship.models import relationship_cache
+    relationship_cache.init_app(app, 'RELATIONSHIP_CACHE')
+    
+    from feed.fragments import fragment_cache
+    fragment_cache.init_app(app, 'FRAGMENT_CACHE')
+    
+    from utilities.storage import storage
+    storage.init_app(app)
+    
+    from user.passwords import passwords
+    passwords.init_app(app)
+    
     from user.views import user_app
     app.register_blueprint(user_app)
     
@@ -0,0 +1,146 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import json
+import time
+from mongoengine.connection import _get_db
+
+from application import create_app
+from user.models import User
+from relationship.models import Relationship
+from relationship.maintenance import rebuild_friend_ids
+from feed.models import Message, Feed, POST, COMMENT
+
+def seed(args):
+    # user 0 reads, users 1..friends are friends with it, the rest are strangers for add_friend
+    users = args.friends + 1 + args.requests
+    user_ids = User._get_collection().insert([
+        {'u': 'bench%d' % i, 'e': 'bench%d@example.com' % i, 'p': 'x', 'fn': 'Bench', 'ln': str(i)}
+        for i in range(users)
+        ])
+    friend_ids = user_ids[1:args.friends + 1]
+    rels = []
+    for friend_id in friend_ids:
+        rels.append({'fu': user_ids[0], 'tu': friend_id, 'rt': Relationship.FRIENDS, 's': Relationship.APPROVED})
+        rels.append({'fu': friend_id, 'tu': user_ids[0], 'rt': Relationship.FRIENDS, 's': Relationship.APPROVED})
+    Relationship._get_collection().insert(rels)
+    rebuild_friend_ids()
+
+    ts = int(time.time() * 1000)
+    messages = []
+    for i, friend_id in enumerate(friend_ids):
+        for j in range(args.posts):
+            messages.append({'fu': friend_id, 't': 'Post %d by friend %d' % (j, i), 'mt': POST,
+                'c': ts - (i * args.posts + j) * 1000, 'cc': args.comments, 'lc': 0, 'rl': [], 'v': 0})
+    message_ids = Message._get_collection().insert(messages)
+    Feed._get_collection().insert([{'u': user_ids[0], 'm': message_id, 'c': message['c']}
+        for (message_id, message) in zip(message_ids, messages)])
+    Message._get_collection().insert([{'fu': friend_ids[0], 't': 'Comment %d' % i, 'mt': COMMENT,
+        'p': message_id, 'c': ts + i} for message_id in message_ids[:args.requests] for i in range(args.comments)])
+    return (user_ids, message_ids)
+
+def scenarios(user_ids, message_ids, args):
+    # name -> function of the iteration returning (method, path, form data)
+    return [
+        ('home', lambda i: ('GET', '/', None)),
+        ('profile', lambda i: ('GET', '/bench%d' % (1 + i % args.friends), None)),
+        ('message', lambda i: ('GET', '/message/%s' % message_ids[i % len(message_ids)], None)),
+        ('add_message', lambda i: ('POST', '/message/add', {'post': 'Benchmark post %d' % i, 'to_user': 'bench0'})),
+        ('like_message', lambda i: ('GET', '/like/%s' % message_ids[i % len(message_ids)], None)),
+        ('add_friend', lambda i: ('GET', '/add_friend/bench%d' % (args.friends + 1 + i), None)),
+        ]
+
+def percentile(timings, p):
+    return timings[min(len(timings) - 1, int(len(timings) * p))]
+
+def run_endpoint(client, scenario, args):
+    timings = []
+    queries = []
+    for i in range(args.requests):
+        (method, path, data) = scenario(i)
+        start = time.time()
+        rv = client.open(path, method=method, data=data)
+        timings.append((time.time() - start) * 1000)
+        if rv.status_code >= 400:
+            raise RuntimeError("%s %s returned %d" % (method, path, rv.status_code))
+        # X-Mongo-Queries: "<count>; <ms>ms; <repeated> repeated"
+        queries.append(int(rv.headers.get('X-Mongo-Queries', '0').split(';')[0]))
+    total_ms = sum(timings)
+    timings.sort()
+    return {
+        'requests': args.requests,
+        'rps': round(args.requests * 1000.0 / total_ms, 1),
+        'p50_ms': round(percentile(timings, 0.50), 2),
+        'p95_ms': round(percentile(timings, 0.95), 2),
+        'p99_ms': round(percentile(timings, 0.99), 2),
+        'queries': round(sum(queries) / float(len(queries)), 1),
+        }
+
+def compare(baseline, results, threshold):
+    # a regression is a p95 or a query count more than threshold percent above the baseline
+    regressions = []
+    print("\n%-14s %14s %14s %14s" % ('vs baseline', 'rps', 'p95', 'queries'))
+    for (name, result) in results['endpoints'].items():
+        base = baseline['endpoints'].get(name)
+        if not base:
+            continue
+        changes = []
+        for field in ('rps', 'p95_ms', 'queries'):
+            changes.append((result[field] - base[field]) * 100.0 / base[field] if base[field] else 0.0)
+        print("%-14s %+13.1f%% %+13.1f%% %+13.1f%%" % ((name,) + tuple(changes)))
+        if changes[1] > threshold or changes[2] > threshold:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput, latency and query counts for the main endpoints")
+    parser.add_argument('--friends', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=5)
+    parser.add_argument('--comments', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--output', help="save the results to this JSON file")
+    parser.add_argument('--compare', help="baseline JSON file from an earlier run")
+    parser.add_argument('--threshold', type=float, default=10.0,
+        help="percent increase in p95 or queries that counts as a regression")
+    args = parser.parse_args()
+
+    app = create_app(
+        MONGODB_SETTINGS={'DB': 'flaskbook_bench'},
+        TESTING=True,
+        WTF_CSRF_ENABLED=False,
+        QUERY_STATS=True,
+        FANOUT_ASYNC=False,
+        IMAGE_ASYNC=False
+        )
+    results = {'args': vars(args), 'endpoints': {}}
+    with app.app_context():
+        db = _get_db()
+        db.client.drop_database(db)
+        try:
+            (user_ids, message_ids) = seed(args)
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session['username'] = 'bench0'
+                session['user_id'] = str(user_ids[0])
+            print("%-14s %10s %10s %10s %10s %10s" % ('endpoint', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+            for (name, scenario) in scenarios(user_ids, message_ids, args):
+                result = run_endpoint(client, scenario, args)
+                results['endpoints'][name] = result
+                print("%-14s %10.1f %10.2f %10.2f %10.2f %10.1f" % (name, result['rps'],
+                    result['p50_ms'], result['p95_ms'], result['p99_ms'], result['queries']))
+        finally:
+            db.client.drop_database(db)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print("\nRegressions: %s" % ', '.join(regressions))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
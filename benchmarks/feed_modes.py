@@ -0,0 +1,72 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import time
+from mongoengine.connection import _get_db
+
+from application import create_app
+from user.models import User
+from relationship.models import Relationship
+from relationship.maintenance import rebuild_friend_ids
+from feed.models import Message, Feed, POST
+from feed.process import process_message
+from feed.timeline import home_timeline
+
+def seed(friends):
+    users = User._get_collection()
+    poster_id = users.insert({'u': 'poster', 'e': 'poster@example.com', 'p': 'x', 'fn': 'Poster'})
+    friend_ids = users.insert([
+        {'u': 'friend%d' % i, 'e': 'friend%d@example.com' % i, 'p': 'x', 'fn': 'Friend'}
+        for i in range(friends)
+        ])
+    rels = []
+    for friend_id in friend_ids:
+        rels.append({'fu': poster_id, 'tu': friend_id, 'rt': Relationship.FRIENDS, 's': Relationship.APPROVED})
+        rels.append({'fu': friend_id, 'tu': poster_id, 'rt': Relationship.FRIENDS, 's': Relationship.APPROVED})
+    Relationship._get_collection().insert(rels)
+    rebuild_friend_ids()
+    return (User.objects.get(id=poster_id), friend_ids)
+    
+def run_mode(app, mode, args):
+    db = _get_db()
+    db.client.drop_database(db)
+    app.config['FEED_FANOUT_THRESHOLD'] = args.friends if mode == 'push' else 0
+    app.config['FEED_PULL_DEPTH'] = 10
+    (poster, friend_ids) = seed(args.friends)
+    
+    # write side: time each post's fan-out and count the feed entries it creates
+    start = time.time()
+    for i in range(args.posts):
+        message = Message(from_user=poster, text="Post %d" % i, message_type=POST).save()
+        process_message(message)
+    write_ms = (time.time() - start) * 1000 / args.posts
+    write_amplification = Feed.objects.count() / float(args.posts)
+    
+    # read side: time the home timeline of a sample of friends
+    readers = [User.objects.get(id=friend_id) for friend_id in friend_ids[:args.reads]]
+    timings = []
+    for reader in readers:
+        start = time.time()
+        home_timeline(reader, 10)
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+    return (write_ms, write_amplification, timings[len(timings) // 2], timings[int(len(timings) * 0.95)])
+    
+def main():
+    parser = argparse.ArgumentParser(description="Compare push and pull feed modes")
+    parser.add_argument('--friends', type=int, default=2000)
+    parser.add_argument('--posts', type=int, default=20)
+    parser.add_argument('--reads', type=int, default=100)
+    args = parser.parse_args()
+    
+    app = create_app(MONGODB_SETTINGS={'DB': 'flaskbook_bench'}, TESTING=True)
+    print("%-6s %14s %20s %12s %12s" % ('mode', 'write ms/post', 'feed entries/post', 'read p50 ms', 'read p95 ms'))
+    with app.app_context():
+        for mode in ('push', 'pull'):
+            print("%-6s %14.2f %20.1f %12.2f %12.2f" % ((mode,) + run_mode(app, mode, args)))
+        db = _get_db()
+        db.client.drop_database(db)
+        
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import multiprocessing
+import resource
+import tempfile
+import time
+from wand.image import Image
+from wand.color import Color
+
+from utilities.imaging import thumbnail_images, height_images, crop_center, store_images
+from utilities.storage import storage, LocalBackend
+
+SIZES = [("sm", 50), ("lg", 75), ("xlg", 200)]
+
+def legacy_thumbnail_images(file, sizes):
+    # the previous pipeline: one decode for the raw output and one per size
+    images = []
+    with Image(filename=file) as img:
+        crop_center(img)
+        img.format = 'png'
+        images.append(('raw', img.make_blob()))
+    for (name, size) in sizes:
+        with Image(filename=file) as img:
+            crop_center(img)
+            img.sample(size, size)
+            img.format = 'png'
+            images.append((name, img.make_blob()))
+    return images
+    
+def legacy_height_images(file, height):
+    with Image(filename=file) as img:
+        img.format = 'png'
+        raw = img.make_blob()
+    with Image(filename=file) as img:
+        img.transform(resize='x' + str(height))
+        img.format = 'png'
+        return ([('raw', raw), ('xlg', img.make_blob())], img.width)
+        
+PIPELINES = {
+    'thumbnail-before': lambda file: legacy_thumbnail_images(file, SIZES),
+    'thumbnail-after': lambda file: thumbnail_images(file, SIZES),
+    'post-before': lambda file: legacy_height_images(file, 200),
+    'post-after': lambda file: height_images(file, 200),
+    'thumbnail-after+store': lambda file: store_images(thumbnail_images(file, SIZES), 'user', 'bench.%s.%s.png', 1),
+    }
+    
+def run_pipeline(name, file, iterations, results):
+    # runs in its own process so the peak RSS belongs to this pipeline only
+    storage.configure(LocalBackend(tempfile.mkdtemp()))
+    timings = []
+    for i in range(iterations):
+        start = time.time()
+        PIPELINES[name](file)
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+    results.put((name, timings[len(timings) // 2], sum(timings) / len(timings),
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+    
+def main():
+    parser = argparse.ArgumentParser(description="Compare the image pipelines before and after single decode")
+    parser.add_argument('--source', help="image to process, a synthetic JPEG is used by default")
+    parser.add_argument('--width', type=int, default=3000)
+    parser.add_argument('--height', type=int, default=2000)
+    parser.add_argument('--iterations', type=int, default=10)
+    args = parser.parse_args()
+    
+    source = args.source
+    if not source:
+        source = os.path.join(tempfile.mkdtemp(), 'source.jpg')
+        with Image(width=args.width, height=args.height, background=Color('skyblue')) as img:
+            img.format = 'jpeg'
+            img.save(filename=source)
+            
+    results = multiprocessing.Queue()
+    print("%-22s %12s %12s %14s" % ('pipeline', 'p50 ms', 'mean ms', 'peak RSS MB'))
+    for name in sorted(PIPELINES):
+        process = multiprocessing.Process(target=run_pipeline, args=(name, source, args.iterations, results))
+        process.start()
+        process.join()
+        print("%-22s %12.1f %12.1f %14.1f" % results.get())
+        
+if __name__ == '__main__':
+    main()
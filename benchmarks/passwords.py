@@ -0,0 +1,39 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from user.passwords import PasswordHasher
+
+PASSWORD = 'correct horse battery staple'
+
+def run_rounds(rounds, args):
+    hasher = PasswordHasher()
+    hasher.configure(rounds, args.workers)
+    hashed = hasher.hash(PASSWORD)
+    
+    # request threads all verifying against the same bounded hashing pool
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.clients) as clients:
+        results = list(clients.map(lambda i: hasher.verify(PASSWORD, hashed), range(args.logins)))
+    elapsed = time.time() - start
+    assert all(results)
+    return (args.logins / elapsed, elapsed * 1000 / args.logins)
+    
+def main():
+    parser = argparse.ArgumentParser(description="Login verification throughput per bcrypt work factor")
+    parser.add_argument('--rounds', type=int, nargs='+', default=[4, 8, 10, 12])
+    parser.add_argument('--logins', type=int, default=50)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+    
+    print("%d logins from %d clients through %d hashing workers" % (args.logins, args.clients, args.workers))
+    print("%-7s %12s %14s" % ('rounds', 'logins/s', 'ms/login'))
+    for rounds in args.rounds:
+        print("%-7d %12.1f %14.2f" % ((rounds,) + run_rounds(rounds, args)))
+        
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import random
+import resource
+import time
+
+from relationship.models import Relationship
+from relationship.suggestions import FriendGraph, FRIENDS
+from utilities.seed import power_law_graph
+
+def rows(friends):
+    # the raw relationship documents for the graph, one per direction, as build() reads them
+    for (u, user_friends) in enumerate(friends):
+        for v in user_friends:
+            yield {'fu': u, 'tu': v, 'rt': Relationship.FRIENDS, 's': Relationship.APPROVED}
+
+def main():
+    parser = argparse.ArgumentParser(description="Friend suggestion latency on an in-memory power-law graph")
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--friends', type=int, default=20, help="average friends per user; edges = users * friends / 2")
+    parser.add_argument('--alpha', type=float, default=1.5)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--max-degree', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    start = time.time()
+    friends = power_law_graph(rng, args.users, args.friends, args.alpha)
+    edges = sum(len(user_friends) for user_friends in friends) // 2
+    print("generated %d users and %d edges in %.1f s" % (args.users, edges, time.time() - start))
+
+    graph = FriendGraph()
+    start = time.time()
+    graph.build(rows(friends))
+    print("built the graph in %.1f s, max rss %d MB" % (time.time() - start,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024))
+    del friends
+
+    timings = []
+    for i in range(args.queries):
+        user_id = rng.randrange(args.users)
+        start = time.time()
+        graph.suggest(user_id, 5, args.max_degree)
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+    print("suggest: p50 %.2f ms, p95 %.2f ms, p99 %.2f ms, max %.2f ms" % (
+        timings[len(timings) // 2], timings[int(len(timings) * 0.95)],
+        timings[int(len(timings) * 0.99)], timings[-1]))
+
+    start = time.time()
+    for i in range(args.queries):
+        graph.set_pair(rng.randrange(args.users), rng.randrange(args.users), FRIENDS)
+    print("incremental update: %.3f ms each" % ((time.time() - start) * 1000 / args.queries))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import heapq
+from flask import current_app
+
+from feed.models import Feed, FeedBucket
+
+def bucket_storage():
+    return current_app.config.get('FEED_STORAGE', 'rows') == 'buckets'
+    
+def push_entries(user_ids, message_id, create_date):
+    # append to each user's open bucket, or start a new one when it's full; users who
+    # already have the entry are skipped and the push is guarded on it, so a retried
+    # fan-out doesn't repeat it. Two pushes racing past a full bucket can each open
+    # one, which the readers handle like any overlapping buckets
+    size = current_app.config.get('FEED_BUCKET_SIZE', 100)
+    collection = FeedBucket._get_collection()
+    pushed = set(bucket['u'] for bucket in collection.find(
+        {'u': {'$in': list(user_ids)}, 'e.m': message_id}, {'u': 1}))
+    user_ids = [user_id for user_id in user_ids if user_id not in pushed]
+    if not user_ids:
+        return 0
+    bulk = collection.initialize_unordered_bulk_op()
+    for user_id in user_ids:
+        bulk.find({'u': user_id, 'n': {'$lt': size}, 'e.m': {'$ne': message_id}}).upsert().update_one({
+            '$push': {'e': {'m': message_id, 'c': create_date}},
+            '$inc': {'n': 1},
+            '$min': {'f': create_date},
+            '$max': {'l': create_date},
+            })
+    result = bulk.execute()
+    return result.get('nUpserted', 0) + result.get('nModified', 0)
+    
+def bucket_entries(user_id, cursor, newer, count):
+    # buckets can overlap in time when entries arrive out of order, so keep reading
+    # until the next bucket can't hold anything closer to the cursor than what we have
+    query = {'u': user_id}
+    if newer:
+        if cursor:
+            query['l'] = {'$gte': cursor[0]}
+        buckets = FeedBucket._get_collection().find(query, {'e': 1, 'f': 1, 'l': 1}).sort('f', 1)
+    else:
+        if cursor:
+            query['f'] = {'$lte': cursor[0]}
+        buckets = FeedBucket._get_collection().find(query, {'e': 1, 'f': 1, 'l': 1}).sort('l', -1)
+    keys = []
+    for bucket in buckets:
+        if len(keys) >= count:
+            bound = keys[count - 1][0]
+            if (newer and bucket['f'] > bound) or (not newer and bucket['l'] < bound):
+                break
+        # deduped before taking the count, so a repeated entry can't shorten the page
+        merged = set(keys)
+        for entry in bucket['e']:
+            key = (entry['c'], entry['m'])
+            if not cursor or (key > cursor if newer else key < cursor):
+                merged.add(key)
+        keys = heapq.nsmallest(count, merged) if newer else heapq.nlargest(count, merged)
+    return keys
+    
+def compact_buckets(user_id, max_depth):
+    # keep the newest buckets holding max_depth entries and drop the rest whole;
+    # everything below the horizon may be gone
+    collection = FeedBucket._get_collection()
+    kept = 0
+    deleted = 0
+    horizon = None
+    dropped = []
+    for bucket in collection.find({'u': user_id}, {'n': 1, 'l': 1}).sort('l', -1):
+        if kept < max_depth:
+            kept += bucket['n']
+        else:
+            dropped.append(bucket['_id'])
+            deleted += bucket['n']
+            horizon = max(horizon or 0, bucket['l'] + 1)
+    if dropped:
+        collection.remove({'_id': {'$in': dropped}})
+    return (deleted, horizon)
+    
+def migrate_feed_rows(batch_size=1000):
+    # rebuild every user's buckets from the Feed rows, oldest entries first
+    size = current_app.config.get('FEED_BUCKET_SIZE', 100)
+    buckets = FeedBucket._get_collection()
+    buckets.remove({})
+    pending = []
+    migrated = 0
+    bucket = None
+    for row in Feed._get_collection().find({}, {'u': 1, 'm': 1, 'c': 1}).sort(
+            [('u', -1), ('c', 1), ('m', 1)]).batch_size(batch_size):
+        if bucket is None or bucket['u'] != row['u'] or bucket['n'] >= size:
+            bucket = {'u': row['u'], 'e': [], 'n': 0, 'f': row['c'], 'l': row['c']}
+            pending.append(bucket)
+        bucket['e'].append({'m': row['m'], 'c': row['c']})
+        bucket['n'] += 1
+        bucket['l'] = row['c']
+        migrated += 1
+        # only insert buckets that can't grow any more
+        if len(pending) > batch_size // size + 1:
+            buckets.insert(pending[:-1])
+            pending = pending[-1:]
+    if pending:
+        buckets.insert(pending)
+    return migrated
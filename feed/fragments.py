@@ -0,0 +1,33 @@
+import hashlib
+from flask import current_app, get_template_attribute
+from jinja2 import Markup
+
+from utilities.cache import LRUCache, MISSING
+
+fragment_cache = LRUCache('fragments', maxsize=5000, ttl=300, maxbytes=16 * 1024 * 1024)
+
+def cached_fragment(key, template, macro, item):
+    if not current_app.config.get('FRAGMENT_CACHE_ENABLED', True):
+        return get_template_attribute(template, macro)(item)
+    html = fragment_cache.get(key)
+    if html is MISSING:
+        html = str(get_template_attribute(template, macro)(item))
+        fragment_cache.set(key, html)
+    return Markup(html)
+    
+def users_key(users):
+    # what a fragment shows of its users, so a profile edit renders it afresh
+    shown = '|'.join('%s:%s:%s:%s:%s' % (user.id, user.username, user.first_name, user.last_name,
+        user.profile_image) for user in users if user)
+    return hashlib.md5(shown.encode('utf-8')).hexdigest()[:12]
+    
+def feed_message(message):
+    # the version bumps on every comment, like and finished image, and the
+    # relative timestamp is part of the key so it never goes stale
+    return cached_fragment('m:%s:%s:%s:%s' % (message.id, message.version, message.human_timestamp,
+        users_key([message.from_user, message.to_user] + message.likers)),
+        'feed/_feed_messages.html', 'render_feed_message', message)
+        
+def feed_comment(comment):
+    return cached_fragment('c:%s:%s:%s' % (comment.id, comment.human_timestamp, users_key([comment.from_user])),
+        'feed/_feed_comments.html', 'render_feed_comment', comment)
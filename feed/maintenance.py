@@ -0,0 +1,120 @@
+from user.models import User
+from feed.models import Message, Feed, FeedBucket, POST, COMMENT, LIKE, RECENT_LIKERS, TEXT_HTML_VERSION
+from feed.buckets import bucket_storage, compact_buckets
+from utilities.common import linkify
+
+def aggregate(pipeline, document=Message):
+    # pymongo 2.x returns a result document, later versions a cursor
+    result = document._get_collection().aggregate(pipeline)
+    return result.get('result', []) if isinstance(result, dict) else result
+    
+def recount_messages(batch_size=1000):
+    collection = Message._get_collection()
+    recounted = 0
+    last_id = None
+    while True:
+        query = {'mt': POST}
+        if last_id:
+            query['_id'] = {'$gt': last_id}
+        message_ids = [message['_id'] for message in
+            collection.find(query, {'_id': 1}).sort('_id', 1).limit(batch_size)]
+        if not message_ids:
+            break
+        last_id = message_ids[-1]
+        
+        comment_counts = dict((row['_id'], row['count']) for row in aggregate([
+            {'$match': {'p': {'$in': message_ids}, 'mt': COMMENT}},
+            {'$group': {'_id': '$p', 'count': {'$sum': 1}}}
+            ]))
+        likes = dict((row['_id'], row) for row in aggregate([
+            {'$match': {'p': {'$in': message_ids}, 'mt': LIKE}},
+            {'$sort': {'c': -1}},
+            {'$group': {'_id': '$p', 'count': {'$sum': 1}, 'likers': {'$push': '$fu'}}}
+            ]))
+            
+        bulk = collection.initialize_unordered_bulk_op()
+        for message_id in message_ids:
+            like = likes.get(message_id, {})
+            bulk.find({'_id': message_id}).update_one({
+                '$set': {
+                    'cc': comment_counts.get(message_id, 0),
+                    'lc': like.get('count', 0),
+                    'rl': like.get('likers', [])[:RECENT_LIKERS],
+                    },
+                '$inc': {'v': 1}
+                })
+        bulk.execute()
+        recounted += len(message_ids)
+    return recounted
+
+    
+def backfill_text_html(batch_size=1000):
+    collection = Message._get_collection()
+    backfilled = 0
+    last_id = None
+    while True:
+        query = {'thv': {'$ne': TEXT_HTML_VERSION}}
+        if last_id:
+            query['_id'] = {'$gt': last_id}
+        messages = list(collection.find(query, {'t': 1}).sort('_id', 1).limit(batch_size))
+        if not messages:
+            break
+        last_id = messages[-1]['_id']
+        
+        bulk = collection.initialize_unordered_bulk_op()
+        for message in messages:
+            bulk.find({'_id': message['_id']}).update_one({'$set': {
+                'th': linkify(message['t']) if message.get('t') else '',
+                'thv': TEXT_HTML_VERSION,
+                }})
+        bulk.execute()
+        backfilled += len(messages)
+    return backfilled
+    
+def compact_feed(user_id, max_depth, batch_size=1000):
+    # keep the newest max_depth entries (and any tied with the last one), delete the
+    # rest in chunks and remember the horizon so reads past it pull from friends instead
+    collection = Feed._get_collection()
+    cutoff = list(collection.find({'u': user_id}, {'c': 1}).sort([('c', -1), ('m', -1)]).skip(max_depth - 1).limit(1))
+    if not cutoff:
+        return 0
+    horizon = cutoff[0]['c']
+    deleted = 0
+    while True:
+        feed_ids = [feed['_id'] for feed in
+            collection.find({'u': user_id, 'c': {'$lt': horizon}}, {'_id': 1}).limit(batch_size)]
+        if not feed_ids:
+            break
+        collection.remove({'_id': {'$in': feed_ids}})
+        deleted += len(feed_ids)
+    if deleted:
+        User._get_collection().update({'_id': user_id}, {'$max': {'fh': horizon}})
+    return deleted
+    
+def compact_feeds(max_depth, batch_size=1000):
+    # walk users in _id batches and only trim the ones over the depth
+    buckets = bucket_storage()
+    users = User._get_collection()
+    compacted = 0
+    last_id = None
+    while True:
+        query = {}
+        if last_id:
+            query['_id'] = {'$gt': last_id}
+        user_ids = [user['_id'] for user in users.find(query, {'_id': 1}).sort('_id', 1).limit(batch_size)]
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+        for row in aggregate([
+            {'$match': {'u': {'$in': user_ids}}},
+            {'$group': {'_id': '$u', 'count': {'$sum': '$n' if buckets else 1}}},
+            {'$match': {'count': {'$gt': max_depth}}}
+            ], FeedBucket if buckets else Feed):
+            if buckets:
+                (deleted, horizon) = compact_buckets(row['_id'], max_depth)
+                if deleted:
+                    users.update({'_id': row['_id']}, {'$max': {'fh': horizon}})
+                compacted += deleted
+            else:
+                compacted += compact_feed(row['_id'], max_depth, batch_size)
+    return compacted
@@ -1,11 +1,11 @@
-from mongoengine import CASCADE
+from mongoengine import CASCADE, signals
 from flask import url_for
 import os
 
 from application import db
 from utilities.common import utc_now_ts_ms as now
-from user.models import User
-from utilities.common import linkify, ms_stamp_humanize
+from user.models import User, IMAGE_STATE
+from utilities.common import linkify, ms_stamp_humanize, ms_stamp_iso
 from settings import STATIC_IMAGE_URL, AWS_BUCKET, AWS_CONTENT_URL
 
 POST = 1
@@ -17,6 +17,15 @@ MESSAGE_TYPE = (
     (COMMENT, 'Comment'),
     (LIKE, 'Like'),
     )
+    
+RECENT_LIKERS = 10
+
+def like_key(message_id, user_id):
+    # set on likes only, unique so two racing likes by one user can't both be written
+    return '%s:%s' % (message_id, user_id)
+
+# bump when the sanitizing rules change so backfill_text_html redoes old messages
+TEXT_HTML_VERSION = 1
 
 class Message(db.Document):
     from_user = db.ReferenceField(User, db_field="fu", reverse_delete_rule=CASCADE)
@@ -26,16 +35,36 @@ class Message(db.Document):
     create_date = db.LongField(db_field="c", default=now())
     parent = db.ObjectIdField(db_field="p", default=None)
     images = db.ListField(db_field="ii")
+    image_state = db.StringField(db_field="is", default=None, choices=IMAGE_STATE)
     message_type = db.IntField(db_field='mt', default=POST, choices=MESSAGE_TYPE)
+    comment_count = db.IntField(db_field="cc", default=0)
+    like_count = db.IntField(db_field="lc", default=0)
+    recent_likers = db.ListField(db.ObjectIdField(), db_field="rl")
+    version = db.IntField(db_field="v", default=0)
+    text_html = db.StringField(db_field="th", default=None)
+    text_html_version = db.IntField(db_field="thv", default=0)
+    like_key = db.StringField(db_field="lk", default=None)
+    
+    @classmethod
+    def pre_save(cls, sender, document, **kwargs):
+        if document.text_html is None or document.text_html_version != TEXT_HTML_VERSION:
+            document.text_html = linkify(document.text) if document.text else ''
+            document.text_html_version = TEXT_HTML_VERSION
     
     @property
     def text_linkified(self):
+        if self.text_html is not None and self.text_html_version == TEXT_HTML_VERSION:
+            return self.text_html
         return linkify(self.text)
         
     @property
     def human_timestamp(self):
         return ms_stamp_humanize(self.create_date)
         
+    @property
+    def iso_timestamp(self):
+        return ms_stamp_iso(self.create_date)
+        
     @property
     def comments(self):
         return Message.objects.filter(parent=self.id, message_type=COMMENT).order_by('create_date')
@@ -51,14 +80,43 @@ class Message(db.Document):
             return url_for('static', filename=os.path.join(STATIC_IMAGE_URL, 'posts', '%s.%s.%s.png' % (self.id, image_ts, size)))
     
     meta = {
-        'indexes': [('from_user', 'to_user', '-create_date', 'parent', 'message_type', 'live')]
+        'indexes': [
+            ('from_user', 'message_type', '-create_date', '-id'),
+            ('to_user', 'message_type', '-create_date', '-id'),
+            ('parent', 'message_type', 'create_date'),
+            ('parent', 'message_type', 'from_user'),
+            {'fields': ('like_key',), 'unique': True, 'sparse': True}
+        ]
     }
     
+signals.pre_save.connect(Message.pre_save, sender=Message)
+    
 class Feed(db.Document):
     user = db.ReferenceField(User, db_field="u", reverse_delete_rule=CASCADE)
     message = db.ReferenceField(Message, db_field="m", reverse_delete_rule=CASCADE)
     create_date = db.LongField(db_field="c", default=now())
     
     meta = {
-        'indexes': [('user', '-create_date')]
-    }
\ No newline at end of file
+        'indexes': [
+            ('user', '-create_date', '-message'),
+            {'fields': ('user', 'message'), 'unique': True}
+        ]
+    }
+
+
+class FeedBucket(db.Document):
+    # up to FEED_BUCKET_SIZE feed entries for one user, each {'m': message id, 'c': create_date}
+    user = db.ReferenceField(User, db_field="u", reverse_delete_rule=CASCADE)
+    entries = db.ListField(db.DictField(), db_field="e")
+    count = db.IntField(db_field="n", default=0)
+    first = db.LongField(db_field="f")
+    last = db.LongField(db_field="l")
+    
+    meta = {
+        'indexes': [
+            ('user', '-last', 'first'),
+            ('user', 'first'),
+            ('user', 'count'),
+            ('user', 'entries.m')
+        ]
+    }
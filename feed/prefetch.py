@@ -0,0 +1,65 @@
+from flask import current_app
+
+from user.models import User, DISPLAY_EXCLUDE
+from feed.models import Message, COMMENT
+from utilities.common import ms_stamps_humanize, ms_stamp_iso
+
+class FeedItem(object):
+    # a message with its users, comment count and likers already loaded
+    def __init__(self, message, from_user, to_user=None, comment_count=0, likers=None):
+        self.message = message
+        self.from_user = from_user
+        self.to_user = to_user
+        self.comment_count = comment_count
+        self.likers = likers or []
+        
+    def __getattr__(self, name):
+        return getattr(self.message, name)
+        
+def humanize_items(items):
+    # one batch humanize per page; left to the browser if it formats timestamps
+    if current_app.config.get('HUMANIZE_IN_BROWSER'):
+        humanized = [None] * len(items)
+    else:
+        humanized = ms_stamps_humanize([item.create_date for item in items])
+    for (item, human_timestamp) in zip(items, humanized):
+        item.human_timestamp = human_timestamp
+        item.iso_timestamp = ms_stamp_iso(item.create_date)
+    return items
+        
+def prefetch_message_ids(message_ids):
+    messages = dict((message['_id'], message) for message in Message.objects.filter(
+        id__in=message_ids
+        ).as_pymongo())
+    return prefetch_messages([messages[message_id] for message_id in message_ids if message_id in messages])
+    
+def prefetch_messages(messages):
+    # messages are raw documents, in display order
+    if not messages:
+        return []
+        
+    # every user on the page in one query
+    user_ids = set()
+    for message in messages:
+        user_ids.add(message.get('fu'))
+        user_ids.add(message.get('tu'))
+        user_ids.update(message.get('rl', []))
+    user_ids.discard(None)
+    users = User.objects.exclude(*DISPLAY_EXCLUDE).in_bulk(list(user_ids))
+    
+    return humanize_items([FeedItem(
+        Message._from_son(message),
+        users.get(message.get('fu')),
+        users.get(message.get('tu')),
+        message.get('cc', 0),
+        [users[user_id] for user_id in message.get('rl', []) if user_id in users]
+        ) for message in messages])
+        
+def prefetch_comments(message_id):
+    comments = list(Message.objects.filter(
+        parent=message_id,
+        message_type=COMMENT
+        ).order_by('create_date').as_pymongo())
+    users = User.objects.exclude(*DISPLAY_EXCLUDE).in_bulk(list(set(comment['fu'] for comment in comments)))
+    return humanize_items([FeedItem(Message._from_son(comment), users.get(comment['fu']))
+        for comment in comments])
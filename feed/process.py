@@ -1,22 +1,71 @@
+import time
+from flask import current_app
+
 from feed.models import Message, Feed
+from feed.buckets import bucket_storage, push_entries
+from user.models import User, IMAGE_READY, IMAGE_FAILED
+from utilities.imaging import post_images_process, discard_uploads
 from relationship.models import Relationship
 
 def process_message(message):
+    start = time.time()
+
+    # the from_user's friends are kept on the user document
+    friend_ids = list(message.from_user.friend_ids)
+        
+    # past the threshold friends pull the user's posts at read time instead;
+    # the flag stays set so posts made while above it remain reachable
+    threshold = current_app.config.get('FEED_FANOUT_THRESHOLD')
+    if threshold is not None and len(friend_ids) > threshold:
+        if not message.from_user.high_fanout:
+            User.objects(id=message.from_user.id).update_one(set__high_fanout=True)
+        friend_ids = []
+
+    # friends who blocked the to_user don't get the message
+    blocked_ids = set()
+    if friend_ids and message.to_user:
+        blocked_ids = set(rel['fu'] for rel in Relationship.objects.filter(
+            from_user__in=friend_ids,
+            to_user=message.to_user,
+            rel_type=Relationship.BLOCKED
+            ).only('from_user').as_pymongo())
+
+    written = 0
+    user_ids = [friend_id for friend_id in friend_ids if friend_id not in blocked_ids]
+    if user_ids and bucket_storage():
+        # one guarded $push per user into their open bucket
+        written = push_entries(user_ids, message.id, message.create_date)
+    elif user_ids:
+        # upsert all the feed entries in one unordered bulk write, so a retried
+        # fan-out never duplicates an entry
+        bulk = Feed._get_collection().initialize_unordered_bulk_op()
+        for user_id in user_ids:
+            bulk.find({'u': user_id, 'm': message.id}).upsert().update_one({
+                '$setOnInsert': {'u': user_id, 'm': message.id, 'c': message.create_date}
+                })
+        written = bulk.execute().get('nUpserted', 0)
+
+    elapsed_ms = (time.time() - start) * 1000
+    current_app.logger.info("fan-out message %s: %d feed entries in %.1f ms",
+        message.id, written, elapsed_ms)
+    return (written, elapsed_ms)
     
-    # get the from_user's friends
-    from_user = message.from_user
-    friends = Relationship.objects.filter(
-        from_user=from_user,
-        rel_type=Relationship.FRIENDS,
-        status=Relationship.APPROVED
-    )
+def fanout_job(payload):
+    message = Message.objects.filter(id=payload.get('message_id')).first()
+    if message:
+        process_message(message)
+        
+def post_images_job(payload):
+    message = Message.objects.filter(id=payload.get('message_id')).first()
+    if message:
+        Message.objects(id=message.id).update_one(
+            set__images=post_images_process(payload.get('files'), 'posts', str(message.id)),
+            set__image_state=IMAGE_READY,
+            inc__version=1)
+    discard_uploads(payload.get('files') or [])
     
-    # get the from_user's friends
-    for friend in friends:
-        rel = Relationship.get_relationship(friend.to_user, message.to_user)
-        if rel != "BLOCKED":
-            feed = Feed(
-                user=friend.to_user,
-                message=message
-            ).save()
-    return True
\ No newline at end of file
+def post_images_failed(payload):
+    Message.objects(id=payload.get('message_id')).update_one(
+        set__image_state=IMAGE_FAILED,
+        inc__version=1)
+    discard_uploads(payload.get('files') or [])
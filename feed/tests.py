@@ -1,10 +1,20 @@
 from application import create_app as create_app_base
 from mongoengine.connection import _get_db
+from mongoengine import NotUniqueError
 import unittest
-from flask import session
+from flask import g
 
 from user.models import User
 from relationship.models import Relationship
+from feed.models import Message, Feed, FeedBucket, POST, LIKE, TEXT_HTML_VERSION, like_key
+from feed.process import process_message
+from feed.maintenance import recount_messages, backfill_text_html, compact_feeds
+from feed.fragments import fragment_cache
+from utilities.queryplans import seed_plan_data, check_query_plans
+from utilities.querystats import QueryStats
+from utilities.seed import seed_dataset
+from feed.timeline import home_timeline
+from feed.buckets import push_entries, bucket_entries, migrate_feed_rows
 
 class FeedTest(unittest.TestCase):
     def create_app(self):
@@ -13,7 +23,8 @@ class FeedTest(unittest.TestCase):
             MONGODB_SETTINGS={'DB': self.db_name},
             TESTING=True,
             WTF_CSRF_ENABLED=False,
-            SECRET_KEY='mySecret!'
+            SECRET_KEY='mySecret!',
+            FANOUT_ASYNC=False
             )
     
     def setUp(self):
@@ -158,4 +169,338 @@ class FeedTest(unittest.TestCase):
             
         # check he doesn't see user 2's post to user 3 (blocked)
         rv = self.app.get('/')
-        assert "Test Post User 2 to User 3" not in str(rv.data)
\ No newline at end of file
+        assert "Test Post User 2 to User 3" not in str(rv.data)
+        
+    def test_process_message_fanout(self):
+        # create a poster with two friends, one of whom blocks the wall owner
+        users = []
+        for user_dict in (self.user1_dict(), self.user2_dict(), self.user3_dict()):
+            users.append(User(
+                username=user_dict['username'],
+                password=user_dict['password'],
+                email=user_dict['email'],
+                first_name=user_dict['first_name'],
+                last_name=user_dict['last_name'],
+                ).save())
+        (poster, friend, blocker) = users
+        for friend_user in (friend, blocker):
+            Relationship(
+                from_user=poster,
+                to_user=friend_user,
+                rel_type=Relationship.FRIENDS,
+                status=Relationship.APPROVED
+                ).save()
+            Relationship.link_friends(poster, friend_user)
+        poster.reload()
+        Relationship(
+            from_user=blocker,
+            to_user=friend,
+            rel_type=Relationship.BLOCKED,
+            status=Relationship.APPROVED
+            ).save()
+            
+        # a post on the friend's wall is not fanned out to the blocker
+        with self.app_factory.app_context():
+            message = Message(
+                from_user=poster,
+                to_user=friend,
+                text="Fan-out post",
+                message_type=POST
+                ).save()
+            (written, elapsed_ms) = process_message(message)
+        assert written == 1
+        assert elapsed_ms >= 0
+        assert Feed.objects.filter(user=friend, message=message).count() == 1
+        assert Feed.objects.filter(user=blocker, message=message).count() == 0
+        
+    def test_feed_comments_and_likes(self):
+        # register and login a user
+        rv = self.app.post('/register', data=self.user1_dict(),
+            follow_redirects=True)
+        rv = self.app.post('/login', data=dict(
+            username=self.user1_dict()['username'],
+            password=self.user1_dict()['password'],
+            ))
+            
+        # post a message; rendering it again is served from the fragment cache
+        rv = self.app.post('/message/add', data=dict(
+            post="Commented Post",
+            to_user=self.user1_dict()['username']
+            ), follow_redirects=True)
+        message = Message.objects.get(text="Commented Post")
+        rv = self.app.get('/')
+        hits = fragment_cache.stats()['hits']
+        rv = self.app.get('/')
+        assert "Commented Post" in str(rv.data)
+        assert fragment_cache.stats()['hits'] > hits
+        
+        # a comment renders the message afresh with the count
+        rv = self.app.post('/message/' + str(message.id), data=dict(
+            post="First comment"
+            ), follow_redirects=True)
+        assert "First comment" in str(rv.data)
+        misses = fragment_cache.stats()['misses']
+        rv = self.app.get('/')
+        assert fragment_cache.stats()['misses'] > misses
+        assert "(1)" in str(rv.data)
+        
+        # so does a like, showing the liker
+        rv = self.app.get('/like/' + str(message.id), follow_redirects=True)
+        misses = fragment_cache.stats()['misses']
+        rv = self.app.get('/')
+        assert fragment_cache.stats()['misses'] > misses
+        assert ">" + self.user1_dict()['username'] + "</a>" in str(rv.data)
+        
+        # and a profile edit by the author
+        User.objects(username=self.user1_dict()['username']).update_one(set__first_name="Renamed")
+        misses = fragment_cache.stats()['misses']
+        rv = self.app.get('/')
+        assert fragment_cache.stats()['misses'] > misses
+        assert "Renamed" in str(rv.data)
+        
+        # the counters are kept on the message
+        message = Message.objects.get(id=message.id)
+        assert message.comment_count == 1
+        assert message.like_count == 1
+        assert len(message.recent_likers) == 1
+        
+        # a second like doesn't count twice
+        rv = self.app.get('/like/' + str(message.id), follow_redirects=True)
+        assert Message.objects.get(id=message.id).like_count == 1
+        
+        # nor does one that raced past the check, it fails the like key
+        user = User.objects.get(username=self.user1_dict()['username'])
+        with self.assertRaises(NotUniqueError):
+            Message(
+                from_user=user,
+                message_type=LIKE,
+                parent=message.id,
+                like_key=like_key(message.id, user.id)
+                ).save()
+        
+        # recounting rebuilds the same counters
+        Message.objects(id=message.id).update_one(set__comment_count=0, set__like_count=0)
+        with self.app_factory.app_context():
+            assert recount_messages() == 1
+        message = Message.objects.get(id=message.id)
+        assert message.comment_count == 1
+        assert message.like_count == 1
+        
+    def test_feed_pagination(self):
+        # register and login a user
+        rv = self.app.post('/register', data=self.user1_dict(),
+            follow_redirects=True)
+        rv = self.app.post('/login', data=dict(
+            username=self.user1_dict()['username'],
+            password=self.user1_dict()['password'],
+            ))
+            
+        # post more than a page of messages
+        for i in range(12):
+            rv = self.app.post('/message/add', data=dict(
+                post="Paged post #%02d" % i,
+                to_user=self.user1_dict()['username']
+                ))
+                
+        # the first page has the newest ten
+        rv = self.app.get('/')
+        assert "Paged post #11" in str(rv.data)
+        assert "Paged post #02" in str(rv.data)
+        assert "Paged post #01" not in str(rv.data)
+        assert "Newer</a>" not in str(rv.data)
+        
+        # the older page has the rest
+        feed = Feed.objects.filter(message=Message.objects.get(text="Paged post #02")).first()
+        rv = self.app.get('/?before=%d_%s' % (feed.create_date, feed.message.id))
+        assert "Paged post #01" in str(rv.data)
+        assert "Paged post #00" in str(rv.data)
+        assert "Paged post #02" not in str(rv.data)
+        assert "Older</a>" not in str(rv.data)
+        assert "Newer</a>" in str(rv.data)
+        
+        # a newer page only links older when something older is left
+        feed = Feed.objects.filter(message=Message.objects.get(text="Paged post #00")).first()
+        rv = self.app.get('/?after=%d_%s' % (feed.create_date, feed.message.id))
+        assert "Paged post #01" in str(rv.data)
+        assert "Older</a>" in str(rv.data)
+        cursor = '%d_%s' % (feed.create_date, feed.message.id)
+        feed.delete()
+        rv = self.app.get('/?after=' + cursor)
+        assert "Paged post #01" in str(rv.data)
+        assert "Older</a>" not in str(rv.data)
+        
+        # a cursor that doesn't parse is rejected
+        rv = self.app.get('/?after=nonsense')
+        assert rv.status_code == 400
+        
+    def test_feed_compaction(self):
+        # register and login a user
+        rv = self.app.post('/register', data=self.user1_dict(),
+            follow_redirects=True)
+        rv = self.app.post('/login', data=dict(
+            username=self.user1_dict()['username'],
+            password=self.user1_dict()['password'],
+            ))
+        for i in range(12):
+            rv = self.app.post('/message/add', data=dict(
+                post="Compacted post #%02d" % i,
+                to_user=self.user1_dict()['username']
+                ))
+                
+        # compaction trims the feed down to the depth and sets the horizon
+        user = User.objects.get(username=self.user1_dict()['username'])
+        with self.app_factory.app_context():
+            deleted = compact_feeds(5, batch_size=2)
+            assert deleted > 0
+            assert compact_feeds(5) == 0
+        assert Feed.objects.filter(user=user).count() == 12 - deleted
+        user = User.objects.get(id=user.id)
+        assert user.feed_horizon == Feed.objects.filter(user=user).order_by('create_date').first().create_date
+        
+        # trimmed posts are still reachable past the horizon
+        rv = self.app.get('/')
+        assert "Compacted post #11" in str(rv.data)
+        assert "Compacted post #02" in str(rv.data)
+        assert "Compacted post #01" not in str(rv.data)
+        message = Message.objects.get(text="Compacted post #02")
+        rv = self.app.get('/?before=%d_%s' % (message.create_date, message.id))
+        assert "Compacted post #01" in str(rv.data)
+        assert "Compacted post #00" in str(rv.data)
+        assert "Older</a>" not in str(rv.data)
+        
+    def test_feed_buckets(self):
+        # register and login a user, posting more than a page
+        rv = self.app.post('/register', data=self.user1_dict(),
+            follow_redirects=True)
+        rv = self.app.post('/login', data=dict(
+            username=self.user1_dict()['username'],
+            password=self.user1_dict()['password'],
+            ))
+        for i in range(5):
+            rv = self.app.post('/message/add', data=dict(
+                post="Row post #%02d" % i,
+                to_user=self.user1_dict()['username']
+                ))
+        user = User.objects.get(username=self.user1_dict()['username'])
+        rows = [(feed.create_date, feed.message.id) for feed in
+            Feed.objects.filter(user=user).order_by('-create_date', '-message')]
+            
+        # the migration packs the rows into buckets with the same entries
+        self.app_factory.config.update(FEED_STORAGE='buckets', FEED_BUCKET_SIZE=2)
+        with self.app_factory.app_context():
+            assert migrate_feed_rows() == 5
+            assert FeedBucket.objects.filter(user=user).count() == 3
+            assert bucket_entries(user.id, None, False, 10) == rows
+            assert bucket_entries(user.id, rows[1], False, 2) == rows[2:4]
+            assert bucket_entries(user.id, rows[3], True, 2) == rows[1:3][::-1]
+            
+            # a repeated push is skipped and a duplicate entry doesn't shorten a page
+            assert push_entries([user.id], rows[0][1], rows[0][0]) == 0
+            assert FeedBucket.objects.filter(user=user).count() == 3
+            duplicate_id = FeedBucket._get_collection().insert({'u': user.id,
+                'e': [{'m': rows[0][1], 'c': rows[0][0]}], 'n': 1, 'f': rows[0][0], 'l': rows[0][0]})
+            assert bucket_entries(user.id, None, False, 2) == rows[:2]
+            FeedBucket._get_collection().remove({'_id': duplicate_id})
+            
+        # new posts are pushed into buckets and pages read across them
+        for i in range(8):
+            rv = self.app.post('/message/add', data=dict(
+                post="Bucket post #%02d" % i,
+                to_user=self.user1_dict()['username']
+                ))
+        assert Feed.objects.filter(user=user).count() == 5
+        assert FeedBucket.objects.filter(user=user).count() == 7
+        rv = self.app.get('/')
+        assert "Bucket post #07" in str(rv.data)
+        assert "Row post #02" in str(rv.data)
+        assert "Row post #01" not in str(rv.data)
+        message = Message.objects.get(text="Row post #02")
+        rv = self.app.get('/?before=%d_%s' % (message.create_date, message.id))
+        assert "Row post #01" in str(rv.data)
+        assert "Row post #00" in str(rv.data)
+        assert "Older</a>" not in str(rv.data)
+        
+    def test_text_html(self):
+        user = User(
+            username=self.user1_dict()['username'],
+            password=self.user1_dict()['password'],
+            email=self.user1_dict()['email']
+            ).save()
+            
+        # the sanitized html is stored when the message is saved
+        message = Message(
+            from_user=user,
+            text="<b>Visit</b> http://example.com",
+            message_type=POST
+            ).save()
+        message = Message.objects.get(id=message.id)
+        assert "<b>" not in message.text_html
+        assert 'href="http://example.com"' in message.text_html
+        assert message.text_linkified == message.text_html
+        
+        # older messages are backfilled in bulk
+        Message.objects(id=message.id).update_one(unset__text_html=True, set__text_html_version=0)
+        with self.app_factory.app_context():
+            assert backfill_text_html() == 1
+        message = Message.objects.get(id=message.id)
+        assert message.text_html_version == TEXT_HTML_VERSION
+        assert 'href="http://example.com"' in message.text_html
+        
+    def test_query_plans(self):
+        # every canonical query is served by an index, sort included
+        with self.app_factory.app_context():
+            seed_plan_data()
+            for (name, bad_stages) in check_query_plans():
+                assert not bad_stages, "%s: %s" % (name, ', '.join(bad_stages))
+                
+    def test_query_stats(self):
+        # instrumented apps report the request's queries in a header
+        app = create_app_base(
+            MONGODB_SETTINGS={'DB': self.db_name},
+            TESTING=True,
+            WTF_CSRF_ENABLED=False,
+            SECRET_KEY='mySecret!',
+            QUERY_STATS=True
+            )
+        rv = app.test_client().post('/register', data=self.user1_dict(), follow_redirects=True)
+        assert 'X-Mongo-Queries' in rv.headers
+        assert 'X-Mongo-Queries' not in self.app.get('/').headers
+        
+        # bulk writes are counted too
+        with app.test_request_context('/'):
+            app.preprocess_request()
+            bulk = Feed._get_collection().initialize_unordered_bulk_op()
+            for i in range(3):
+                bulk.find({'u': i, 'm': i}).upsert().update_one({'$setOnInsert': {'c': i}})
+            bulk.execute()
+            assert g.query_stats.collections.get('feed', 0) >= 1
+            
+        # the same shape with different values repeated past the threshold is flagged
+        stats = QueryStats(3)
+        for i in range(3):
+            stats.record('find', 'user', {'_id': i}, 1.0)
+        stats.record('find', 'message', {'fu': 1, 'mt': 1}, 1.0)
+        summary = stats.summary()
+        assert summary['queries'] == 4
+        assert summary['collections'] == {'user': 3, 'message': 1}
+        assert [row['count'] for row in summary['repeated']] == [3]
+        
+    def test_seed_dataset(self):
+        # the same seed gives the same data
+        with self.app_factory.app_context():
+            counts = seed_dataset(users=50, avg_friends=4, seed=3, now_ms=1500000000000)
+            assert counts['User'] == 50
+            assert counts['Relationship'] == Relationship.objects.count()
+            message_ids = [message['_id'] for message in Message._get_collection().find({}, {'_id': 1})]
+            db = _get_db()
+            db.client.drop_database(db)
+            assert seed_dataset(users=50, avg_friends=4, seed=3, now_ms=1500000000000) == counts
+            assert sorted(message_ids) == sorted(message['_id'] for message in
+                Message._get_collection().find({}, {'_id': 1}))
+                
+            # friendships come in approved pairs and seeded feeds are readable
+            user = User.objects.get(username='user0')
+            for rel in Relationship.objects.filter(from_user=user, rel_type=Relationship.FRIENDS):
+                assert Relationship.objects.filter(from_user=rel.to_user, to_user=user,
+                    status=Relationship.APPROVED).count() == 1
+            assert len(home_timeline(user, 10).items) == min(10, Feed.objects.filter(user=user).count())
@@ -0,0 +1,85 @@
+import itertools
+from bson.objectid import ObjectId
+from flask import current_app
+
+from user.models import User
+from feed.models import Message, Feed, POST
+from relationship.models import Relationship
+from feed.prefetch import prefetch_message_ids
+from feed.buckets import bucket_storage, bucket_entries
+from utilities.pagination import keyset_query, decode_cursor, KeysetPage
+
+def home_timeline(user, limit=10, before=None, after=None):
+    # pages are keyed on (create_date, message id), newest first
+    newer = after is not None
+    cursor = decode_cursor(after if newer else before, 2)
+    keys = timeline_keys(user, cursor, newer, limit + 1)
+    page = KeysetPage(keys, limit, lambda key: key, before, after,
+        lambda key: bool(timeline_keys(user, key, False, 1)), cursor)
+    page.items = prefetch_message_ids([key[1] for key in page.items])
+    return page
+    
+def timeline_keys(user, cursor, newer, count):
+    # the first count (create_date, message id) keys past the cursor;
+    # entries pushed into the user's feed at write time
+    if bucket_storage():
+        streams = [bucket_entries(user.id, cursor, newer, count)]
+    else:
+        streams = [[(feed['c'], feed['m']) for feed in keyset_query(Feed,
+            [{'user': user}], ('create_date', 'message'), cursor, newer
+            ).only('message', 'create_date').as_pymongo()[:count]]]
+    
+    # high fan-out friends aren't pushed, so pull their recent posts instead
+    friend_ids = list(user.friend_ids)
+    pull_ids = [pull_user['_id'] for pull_user in User.objects.filter(
+        id__in=friend_ids,
+        high_fanout=True
+        ).only('id').as_pymongo()] if friend_ids else []
+        
+    # compaction trimmed the feed below the horizon; past it, or once the kept
+    # entries run out, pull the user's and friends' posts from before it
+    horizon = user.feed_horizon
+    past_horizon = horizon and ((newer and cursor and cursor[0] < horizon) or
+        (not newer and len(streams[0]) < count))
+        
+    blocked_ids = set()
+    if pull_ids or past_horizon:
+        blocked_ids = set(rel['tu'] for rel in Relationship.objects.filter(
+            from_user=user,
+            rel_type=Relationship.BLOCKED
+            ).only('to_user').as_pymongo())
+    depth = min(current_app.config.get('FEED_PULL_DEPTH', 50), count)
+    for pull_id in pull_ids:
+        streams.append([(message['c'], message['_id']) for message in keyset_query(Message,
+            [{'from_user': pull_id, 'message_type': POST}], ('create_date', 'id'), cursor, newer
+            ).only('create_date', 'to_user').as_pymongo()[:depth]
+            if message.get('tu') not in blocked_ids])
+            
+    if past_horizon:
+        history_cursor = cursor
+        if not newer and (not cursor or cursor[0] >= horizon):
+            history_cursor = (horizon, ObjectId('0' * 24))
+        # one equality branch per author so each walks its own index range and the
+        # server merges them in order; a big $in would sort in memory instead.
+        # Batches bound each query and only the most recent friends are read
+        config = current_app.config
+        authors = [user.id] + friend_ids[::-1][:config.get('FEED_HISTORY_FRIENDS', 500)]
+        batch_size = config.get('FEED_HISTORY_BATCH', 50)
+        for i in range(0, len(authors), batch_size):
+            streams.append([(message['c'], message['_id']) for message in keyset_query(Message,
+                [{'from_user': author_id, 'message_type': POST} for author_id in authors[i:i + batch_size]],
+                ('create_date', 'id'), history_cursor, newer
+                ).only('create_date', 'to_user').as_pymongo()[:count]
+                if message['c'] < horizon and message.get('tu') not in blocked_ids])
+                
+    # each stream holds at most count keys, so sorting them together is cheap
+    # (heapq.merge only takes reverse on python 3.5+)
+    keys = []
+    seen = set()
+    for key in sorted(itertools.chain.from_iterable(streams), reverse=not newer):
+        if key[1] not in seen:
+            seen.add(key[1])
+            keys.append(key)
+            if len(keys) >= count:
+                break
+    return keys
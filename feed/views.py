@@ -1,17 +1,23 @@
-from flask import Blueprint, request, session, redirect, url_for, abort, render_template
-from werkzeug import secure_filename
-import os
+from mongoengine import NotUniqueError
+from flask import Blueprint, request, redirect, url_for, abort, render_template, current_app, g
 
 from user.decorators import login_required
-from user.models import User
-from feed.models import Message, Feed, POST, COMMENT, LIKE
+from user.models import User, IMAGE_PROCESSING
+from feed.models import Message, Feed, POST, COMMENT, LIKE, RECENT_LIKERS, like_key
 from feed.process import process_message
+from feed.buckets import bucket_storage, push_entries
+from feed.prefetch import prefetch_messages, prefetch_comments
+from feed.fragments import feed_message, feed_comment
 from feed.forms import FeedPostForm
-from settings import UPLOAD_FOLDER
-from utilities.imaging import image_height_transform
+from jobs.models import FANOUT, POST_IMAGES
+from jobs.process import enqueue
+from utilities.imaging import stage_upload, discard_uploads, post_images_process
 
 feed_app = Blueprint('feed_app', __name__)
 
+feed_app.add_app_template_global(feed_message)
+feed_app.add_app_template_global(feed_comment)
+
 @feed_app.route('/message/add', methods=('GET', 'POST'))
 @login_required
 def add_message():
@@ -24,19 +30,20 @@ def add_message():
         uploaded_files = request.files.getlist('images')
         if uploaded_files and uploaded_files[0].filename != '':
             for file in uploaded_files:
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(UPLOAD_FOLDER, 'posts', filename)
-                file.save(file_path)
-                post_images.append(file_path)
+                post_images.append(stage_upload(file, 'posts'))
                 
         # process post
-        from_user = User.objects.get(username=session.get('username'))
-        to_user = User.objects.get(username=request.values.get('to_user'))
+        from_user = g.user
         post = form.post.data
 
         # if this is a self post
-        if to_user == from_user:
+        if request.values.get('to_user') == from_user.username:
             to_user = None
+        else:
+            to_user = User.objects.get(username=request.values.get('to_user'))
+            
+        # images are processed in the background if there's a job worker
+        images_async = len(post_images) and current_app.config.get('IMAGE_ASYNC')
             
         # write the message
         message = Message(
@@ -44,25 +51,32 @@ def add_message():
             to_user=to_user,
             text=post,
             message_type=POST,
+            image_state=IMAGE_PROCESSING if images_async else None
             ).save()
             
         # store on the same user's feed
-        feed = Feed(
-            user=from_user,
-            message=message,
-            ).save()
+        if bucket_storage():
+            push_entries([from_user.id], message.id, message.create_date)
+        else:
+            Feed(
+                user=from_user,
+                message=message,
+                create_date=message.create_date
+                ).save()
         
         # store images
-        if len(post_images):
-            images = []
-            for file_path in post_images:
-                (image_ts, width) = image_height_transform(file_path, 'posts', str(message.id))
-                images.append({"ts": str(image_ts), "w": str(width)})
-            message.images = images
+        if images_async:
+            enqueue(POST_IMAGES, {'message_id': str(message.id), 'files': post_images})
+        elif len(post_images):
+            message.images = post_images_process(post_images, 'posts', str(message.id))
             message.save()
+            discard_uploads(post_images)
             
-        # process the message
-        process_message(message)
+        # process the message, in the background if there's a job worker
+        if current_app.config.get('FANOUT_ASYNC'):
+            enqueue(FANOUT, {'message_id': str(message.id)})
+        else:
+            process_message(message)
         
         if ref:
             return redirect(ref)
@@ -75,18 +89,15 @@ def add_message():
 @feed_app.route('/message/<message_id>', methods=('GET', 'POST'))
 def message(message_id):
     form = FeedPostForm()
-    message = None
     
-    message = Message.objects.filter(id=message_id).first()
-    if not message:
-        abort(404)
-        
-    if message and message.parent:
+    # one raw read serves both the checks and the page
+    message = Message.objects.filter(id=message_id).as_pymongo().first()
+    if not message or message.get('p'):
         abort(404)
         
-    if form.validate_on_submit() and session.get('username'):
+    if form.validate_on_submit() and g.user:
         # process post
-        from_user = User.objects.get(username=session.get('username'))
+        from_user = g.user
         post = form.post.data
         
         # write the message
@@ -94,13 +105,15 @@ def message(message_id):
             from_user=from_user,
             text=post,
             message_type=COMMENT,
-            parent=message_id
+            parent=message['_id']
             ).save()
+        Message.objects(id=message['_id']).update_one(inc__comment_count=1, inc__version=1)
             
-        return redirect(url_for('feed_app.message', message_id=message.id))
+        return redirect(url_for('feed_app.message', message_id=message['_id']))
             
     return render_template('feed/message.html',
-        message=message,
+        message=prefetch_messages([message])[0],
+        comments=prefetch_comments(message['_id']),
         form=form
     )
     
@@ -116,7 +129,7 @@ def like_message(message_id):
     if message and message.parent:
         abort(404)
         
-    from_user = User.objects.get(username=session.get('username'))
+    from_user = g.user
     
     #check if first like
     existing_like = Message.objects.filter(
@@ -125,12 +138,23 @@ def like_message(message_id):
         from_user=from_user).count()
 
     if not existing_like:
-        # write the like
-        like = Message(
-            from_user=from_user,
-            to_user=message.from_user,
-            message_type=LIKE,
-            parent=message_id
-            ).save()
+        # write the like; a request racing this one for the same like fails the unique key
+        try:
+            like = Message(
+                from_user=from_user,
+                to_user=message.from_user,
+                message_type=LIKE,
+                parent=message_id,
+                like_key=like_key(message.id, from_user.id)
+                ).save()
+        except NotUniqueError:
+            like = None
+            
+        if like:
+            # count it and keep the newest likers on the message
+            Message._get_collection().update({'_id': message.id}, {
+                '$inc': {'lc': 1, 'v': 1},
+                '$push': {'rl': {'$each': [from_user.id], '$position': 0, '$slice': RECENT_LIKERS}}
+                })
         
     return redirect(url_for('feed_app.message', message_id=message.id))
\ No newline at end of file
@@ -1,30 +1,36 @@
-from flask import Blueprint, session, render_template
+from flask import Blueprint, render_template, current_app, jsonify, abort, request, g
 
-from user.models import User
-from feed.models import Feed
 from feed.forms import FeedPostForm
+from feed.timeline import home_timeline
+from relationship.suggestions import suggest_friends
+from utilities.cache import cache_stats
 
 home_app = Blueprint('home_app', __name__)
 
 @home_app.route('/')
 def home():
     
-    if session.get('username'):
+    if g.user:
         form = FeedPostForm()
         
-        user = User.objects.filter(
-            username=session.get('username')
-            ).first()
+        user = g.user
             
-        feed_messages = Feed.objects.filter(
-            user=user
-            ).order_by('-create_date')[:10]
+        feed_page = home_timeline(user, 10,
+            before=request.args.get('before'),
+            after=request.args.get('after'))
             
         return render_template('home/feed_home.html',
             user=user,
             form=form,
-            feed_messages=feed_messages
+            feed_page=feed_page,
+            suggestions=suggest_friends(user)
             )
             
     else:
-        return render_template('home/home.html')
\ No newline at end of file
+        return render_template('home/home.html')
+        
+@home_app.route('/_stats/caches')
+def caches():
+    if not current_app.debug:
+        abort(404)
+    return jsonify(cache_stats())
\ No newline at end of file
@@ -0,0 +1,39 @@
+from application import db
+from utilities.common import utc_now_ts_ms as now
+
+FANOUT = 'fanout'
+POST_IMAGES = 'post_images'
+PROFILE_IMAGE = 'profile_image'
+
+JOB_TYPE = (
+    (FANOUT, 'Feed fan-out'),
+    (POST_IMAGES, 'Post images'),
+    (PROFILE_IMAGE, 'Profile image'),
+    )
+
+class Job(db.Document):
+    
+    PENDING = 0
+    RUNNING = 1
+    DONE = 2
+    FAILED = 3
+    
+    STATUS_TYPE = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+        )
+        
+    job_type = db.StringField(db_field="jt", required=True, choices=JOB_TYPE)
+    payload = db.DictField(db_field="pl")
+    status = db.IntField(db_field="s", default=PENDING, choices=STATUS_TYPE)
+    attempts = db.IntField(db_field="a", default=0)
+    run_after = db.LongField(db_field="ra", default=now())
+    locked_until = db.LongField(db_field="lu", default=0)
+    create_date = db.LongField(db_field="c", default=now())
+    error = db.StringField(db_field="e", default=None)
+    
+    meta = {
+        'indexes': [('status', 'run_after'), ('status', 'locked_until')]
+    }
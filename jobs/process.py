@@ -0,0 +1,116 @@
+import time
+import threading
+import multiprocessing
+from flask import current_app
+
+from jobs.models import Job, FANOUT, POST_IMAGES, PROFILE_IMAGE
+from utilities.common import utc_now_ts_ms as now
+
+def handlers():
+    from feed.process import fanout_job, post_images_job
+    from user.process import profile_image_job
+    return {
+        FANOUT: fanout_job,
+        POST_IMAGES: post_images_job,
+        PROFILE_IMAGE: profile_image_job,
+        }
+        
+def failure_handlers():
+    # run once when a job has used up its attempts
+    from feed.process import post_images_failed
+    from user.process import profile_image_failed
+    return {
+        POST_IMAGES: post_images_failed,
+        PROFILE_IMAGE: profile_image_failed,
+        }
+
+def enqueue(job_type, payload):
+    return Job(job_type=job_type, payload=payload).save()
+
+def claim():
+    # atomically take the oldest due job, or one whose worker died mid-run
+    ts = now()()
+    lease_ms = current_app.config.get('JOBS_LEASE_MS', 60000)
+    raw = Job._get_collection().find_and_modify(
+        query={'$or': [
+            {'s': Job.PENDING, 'ra': {'$lte': ts}},
+            {'s': Job.RUNNING, 'lu': {'$lt': ts}},
+            ]},
+        update={
+            '$set': {'s': Job.RUNNING, 'lu': ts + lease_ms},
+            '$inc': {'a': 1},
+            },
+        sort=[('ra', 1)],
+        new=True
+        )
+    if raw:
+        return Job._from_son(raw)
+    return None
+    
+def run_job(job):
+    handler = handlers().get(job.job_type)
+    try:
+        if not handler:
+            raise ValueError("No handler for job type %s" % job.job_type)
+        handler(job.payload)
+    except Exception as e:
+        current_app.logger.exception("job %s (%s) failed on attempt %d",
+            job.id, job.job_type, job.attempts)
+        if job.attempts >= current_app.config.get('JOBS_MAX_ATTEMPTS', 5):
+            Job.objects(id=job.id).update_one(
+                set__status=Job.FAILED,
+                set__error=str(e))
+            failed = failure_handlers().get(job.job_type)
+            if failed:
+                try:
+                    failed(job.payload)
+                except Exception:
+                    current_app.logger.exception("failure handler for job %s (%s) failed",
+                        job.id, job.job_type)
+        else:
+            # exponential backoff: 1x, 2x, 4x... the base delay
+            backoff_ms = current_app.config.get('JOBS_BACKOFF_MS', 1000) * 2 ** (job.attempts - 1)
+            Job.objects(id=job.id).update_one(
+                set__status=Job.PENDING,
+                set__run_after=now()() + backoff_ms,
+                set__error=str(e))
+        return False
+    Job.objects(id=job.id).update_one(set__status=Job.DONE, set__error=None)
+    return True
+    
+def work(app, stop, poll_interval):
+    with app.app_context():
+        while not stop.is_set():
+            job = claim()
+            if job:
+                run_job(job)
+            else:
+                stop.wait(poll_interval)
+                
+def _work_process(stop, poll_interval):
+    # each process needs its own app and mongo connection
+    from application import create_app
+    work(create_app(), stop, poll_interval)
+    
+def run_pool(app, workers, use_processes=False):
+    poll_interval = app.config.get('JOBS_POLL_INTERVAL', 1.0)
+    if use_processes:
+        stop = multiprocessing.Event()
+        pool = [multiprocessing.Process(target=_work_process, args=(stop, poll_interval))
+            for i in range(workers)]
+    else:
+        stop = threading.Event()
+        pool = [threading.Thread(target=work, args=(app, stop, poll_interval))
+            for i in range(workers)]
+    for worker in pool:
+        worker.daemon = True
+        worker.start()
+    app.logger.info("job worker started with %d %s", workers,
+        'processes' if use_processes else 'threads')
+    try:
+        while any(worker.is_alive() for worker in pool):
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        stop.set()
+    for worker in pool:
+        worker.join()
@@ -0,0 +1,225 @@
+from application import create_app as create_app_base
+from mongoengine.connection import _get_db
+import os
+import io
+import shutil
+import tempfile
+import unittest
+
+from user.models import User
+from feed.models import Message, Feed
+from jobs.models import Job, FANOUT, POST_IMAGES, PROFILE_IMAGE
+from jobs.process import enqueue, claim, run_job
+from utilities.storage import storage, LocalBackend
+
+IMAGE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'static', 'images', 'user', 'no-profile.raw.png')
+
+class FailingBackend(object):
+    def put(self, key, data, content_type):
+        raise IOError("storage is down")
+
+class JobTest(unittest.TestCase):
+    def create_app(self):
+        self.db_name = 'flaskbook_test'
+        return create_app_base(
+            MONGODB_SETTINGS={'DB': self.db_name},
+            TESTING=True,
+            WTF_CSRF_ENABLED=False,
+            SECRET_KEY='mySecret!',
+            FANOUT_ASYNC=True,
+            JOBS_MAX_ATTEMPTS=2,
+            JOBS_BACKOFF_MS=0,
+            IMAGE_ASYNC=True,
+            UPLOAD_FOLDER=self.upload_folder,
+            STORAGE_BACKEND='local'
+            )
+            
+    def setUp(self):
+        self.upload_folder = tempfile.mkdtemp()
+        self.app_factory = self.create_app()
+        self.app = self.app_factory.test_client()
+        
+    def tearDown(self):
+        db = _get_db()
+        db.client.drop_database(db)
+        shutil.rmtree(self.upload_folder)
+        
+    def image(self):
+        with open(IMAGE_FILE, 'rb') as f:
+            return (io.BytesIO(f.read()), 'image.png')
+        
+    def user1_dict(self):
+        return dict(
+            first_name="Jorge",
+            last_name="Escobar",
+            username="jorge",
+            email="jorge@example.com",
+            password="test123",
+            confirm="test123"
+            )
+            
+    def user2_dict(self):
+        return dict(
+            first_name="Javier",
+            last_name="Escobar",
+            username="javier",
+            email="javier@example.com",
+            password="test123",
+            confirm="test123"
+            )
+            
+    def test_fanout_job(self):
+        # register two friends
+        for user_dict in (self.user1_dict(), self.user2_dict()):
+            self.app.post('/register', data=user_dict, follow_redirects=True)
+        self.app.post('/login', data=dict(
+            username=self.user1_dict()['username'],
+            password=self.user1_dict()['password']
+            ))
+        self.app.get('/add_friend/' + self.user2_dict()['username'])
+        self.app.post('/login', data=dict(
+            username=self.user2_dict()['username'],
+            password=self.user2_dict()['password']
+            ))
+        self.app.get('/add_friend/' + self.user1_dict()['username'])
+        
+        # posting only queues the fan-out
+        self.app.post('/message/add', data=dict(
+            post="Queued post",
+            to_user=self.user2_dict()['username']
+            ), follow_redirects=True)
+        friend = User.objects.get(username=self.user1_dict()['username'])
+        assert Job.objects.filter(job_type=FANOUT, status=Job.PENDING).count() == 1
+        assert Feed.objects.filter(user=friend).count() == 0
+        
+        # the worker writes the friend's feed
+        with self.app_factory.app_context():
+            job = claim()
+            assert job.status == Job.RUNNING
+            assert run_job(job)
+            assert claim() is None
+        assert Feed.objects.filter(user=friend).count() == 1
+        
+        # a retried job doesn't duplicate the entry
+        with self.app_factory.app_context():
+            run_job(job)
+        assert Feed.objects.filter(user=friend).count() == 1
+        
+    def test_job_retries(self):
+        with self.app_factory.app_context():
+            job = enqueue(FANOUT, {'message_id': 'not-an-id'})
+            
+            # first failure goes back to pending
+            assert not run_job(claim())
+            assert Job.objects.get(id=job.id).status == Job.PENDING
+            
+            # last attempt marks it failed
+            assert not run_job(claim())
+            job = Job.objects.get(id=job.id)
+            assert job.status == Job.FAILED
+            assert job.attempts == 2
+            assert claim() is None
+            
+    def test_image_jobs(self):
+        self.app_factory.config['FANOUT_ASYNC'] = False
+        self.app.post('/register', data=self.user1_dict(), follow_redirects=True)
+        self.app.post('/login', data=dict(
+            username=self.user1_dict()['username'],
+            password=self.user1_dict()['password']
+            ))
+            
+        # two uploads with the same name are staged apart and queued
+        for i in range(2):
+            self.app.post('/message/add', data=dict(
+                post="Image post #%d" % i,
+                to_user=self.user1_dict()['username'],
+                images=self.image()
+                ))
+        jobs = list(Job.objects.filter(job_type=POST_IMAGES).order_by('id'))
+        messages = [Message.objects.get(text="Image post #%d" % i) for i in range(2)]
+        assert [job.payload['message_id'] for job in jobs] == [str(message.id) for message in messages]
+        files = [job.payload['files'][0] for job in jobs]
+        assert files[0] != files[1] and all(os.path.exists(file) for file in files)
+        assert messages[0].image_state == "processing"
+        
+        # a successful run stores the derivatives and then drops the staged file
+        with self.app_factory.app_context():
+            assert run_job(claim()) and run_job(claim())
+        for (message, file) in zip(messages, files):
+            message = Message.objects.get(id=message.id)
+            assert message.image_state == "ready" and len(message.images) == 1
+            assert os.path.exists(os.path.join(self.upload_folder, 'posts',
+                '%s.%s.xlg.png' % (message.id, message.images[0]['ts'])))
+            assert not os.path.exists(file)
+            
+        # a failed run keeps the staged file for the retry
+        self.app.post('/message/add', data=dict(
+            post="Retried image post",
+            to_user=self.user1_dict()['username'],
+            images=self.image()
+            ))
+        message = Message.objects.get(text="Retried image post")
+        file = Job.objects.get(payload__message_id=str(message.id)).payload['files'][0]
+        with self.app_factory.app_context():
+            storage.configure(FailingBackend())
+            assert not run_job(claim())
+            assert os.path.exists(file)
+            storage.configure(LocalBackend(self.upload_folder))
+            assert run_job(claim())
+        assert Message.objects.get(id=message.id).image_state == "ready"
+        assert not os.path.exists(file)
+        
+        # running out of attempts marks the message failed
+        self.app.post('/message/add', data=dict(
+            post="Failed image post",
+            to_user=self.user1_dict()['username'],
+            images=self.image()
+            ))
+        message = Message.objects.get(text="Failed image post")
+        job = Job.objects.get(payload__message_id=str(message.id))
+        with self.app_factory.app_context():
+            storage.configure(FailingBackend())
+            assert not run_job(claim())
+            assert not run_job(claim())
+            storage.configure(LocalBackend(self.upload_folder))
+        assert Job.objects.get(id=job.id).status == Job.FAILED
+        assert Message.objects.get(id=message.id).image_state == "failed"
+        assert not os.path.exists(job.payload['files'][0])
+        rv = self.app.get('/')
+        assert "Image processing failed" in str(rv.data)
+        
+    def test_profile_image_job(self):
+        for user_dict in (self.user1_dict(), self.user2_dict()):
+            self.app.post('/register', data=user_dict, follow_redirects=True)
+        self.app.post('/login', data=dict(
+            username=self.user1_dict()['username'],
+            password=self.user1_dict()['password']
+            ))
+            
+        # a form error stages nothing and queues nothing
+        edit = self.user1_dict()
+        edit['username'] = self.user2_dict()['username']
+        edit['image'] = self.image()
+        rv = self.app.post('/edit', data=edit)
+        assert "Username already exists" in str(rv.data)
+        assert Job.objects.filter(job_type=PROFILE_IMAGE).count() == 0
+        assert not os.path.isdir(os.path.join(self.upload_folder, 'user'))
+            
+        # a valid edit queues the staged image
+        edit = self.user1_dict()
+        edit['image'] = self.image()
+        self.app.post('/edit', data=edit)
+        user = User.objects.get(username=self.user1_dict()['username'])
+        job = Job.objects.get(job_type=PROFILE_IMAGE)
+        assert job.payload['user_id'] == str(user.id)
+        assert os.path.exists(job.payload['file'])
+        assert user.profile_image_state == "processing"
+        
+        # the job stores the thumbnails and drops the staged file
+        with self.app_factory.app_context():
+            assert run_job(claim())
+        user = User.objects.get(id=user.id)
+        assert user.profile_image_state == "ready"
+        assert os.path.exists(os.path.join(self.upload_folder, 'user',
+            '%s.%s.sm.png' % (user.id, user.profile_image)))
+        assert not os.path.exists(job.payload['file'])
@@ -13,6 +13,98 @@ manager.add_command("runserver", Server(
     port=int(os.getenv('PORT', 5000)))
 )
 
+@manager.option('-w', '--workers', dest='workers', type=int, default=None)
+@manager.option('--processes', dest='processes', action='store_true', default=False)
+def worker(workers, processes):
+    "Run the background job worker pool"
+    from jobs.process import run_pool
+    run_pool(app, workers or app.config.get('JOBS_WORKERS', 4), processes)
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=None)
+def mail_worker(batch_size):
+    "Send queued emails from the outbox"
+    from outbox.process import run_mailer
+    run_mailer(app, batch_size)
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000)
+def recount_messages(batch_size):
+    "Recompute comment and like counters on every post"
+    from feed.maintenance import recount_messages
+    print("Recounted %d messages" % recount_messages(batch_size))
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000)
+def backfill_text_html(batch_size):
+    "Store sanitized, linkified HTML on messages saved before the current version"
+    from feed.maintenance import backfill_text_html
+    print("Backfilled %d messages" % backfill_text_html(batch_size))
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000)
+def rebuild_friend_ids(batch_size):
+    "Recompute every user's friend_ids and friend_count from the approved relationships"
+    from relationship.maintenance import rebuild_friend_ids
+    print("Rebuilt %d users" % rebuild_friend_ids(batch_size))
+
+@manager.option('-d', '--depth', dest='max_depth', type=int, default=None)
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000)
+def compact_feeds(max_depth, batch_size):
+    "Trim every home feed to FEED_MAX_DEPTH entries in chunked deletes"
+    from feed.maintenance import compact_feeds
+    print("Deleted %d feed entries" % compact_feeds(max_depth or app.config.get('FEED_MAX_DEPTH', 1000), batch_size))
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000)
+def migrate_feed_buckets(batch_size):
+    "Rebuild the bucketed home feeds from the Feed rows before switching FEED_STORAGE to buckets"
+    from feed.buckets import migrate_feed_rows
+    print("Migrated %d feed entries" % migrate_feed_rows(batch_size))
+
+@manager.option('-u', '--users', dest='users', type=int, default=1000)
+@manager.option('-f', '--friends', dest='avg_friends', type=int, default=20)
+@manager.option('-a', '--alpha', dest='alpha', type=float, default=1.5)
+@manager.option('-p', '--posts', dest='posts', type=int, default=5)
+@manager.option('-c', '--comments', dest='comments', type=int, default=2)
+@manager.option('-l', '--likes', dest='likes', type=int, default=3)
+@manager.option('--blocks', dest='blocks', type=float, default=0.01)
+@manager.option('--days', dest='days', type=int, default=30)
+@manager.option('--seed', dest='seed', type=int, default=1)
+@manager.option('--now', dest='now_ms', type=int, default=None)
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=10000)
+@manager.option('--drop', dest='drop', action='store_true', default=False)
+def seed(users, avg_friends, alpha, posts, comments, likes, blocks, days, seed, now_ms, batch_size, drop):
+    "Generate a synthetic social graph with bulk inserts; the same seed and --now give the same data"
+    import time
+    from mongoengine.connection import _get_db
+    from utilities.seed import seed_dataset
+    if drop:
+        db = _get_db()
+        db.client.drop_database(db)
+    start = time.time()
+    counts = seed_dataset(users, avg_friends, alpha, posts, comments, likes, blocks,
+        app.config.get('FEED_FANOUT_THRESHOLD'), days, seed, batch_size, now_ms)
+    for (name, count) in sorted(counts.items()):
+        print("%-14s %10d" % (name, count))
+    print("Seeded in %.1f s" % (time.time() - start))
+
+@manager.option('-d', '--db', dest='db_name', default='flaskbook_explain')
+def check_indexes(db_name):
+    "Explain the canonical queries on a seeded scratch database; fail on collection scans or in-memory sorts"
+    from mongoengine.connection import disconnect, _get_db
+    from utilities.queryplans import seed_plan_data, check_query_plans
+    # reconnect to the scratch database so the seed never touches real data
+    disconnect()
+    check_app = create_app(MONGODB_SETTINGS={'DB': db_name})
+    with check_app.app_context():
+        db = _get_db()
+        db.client.drop_database(db)
+        try:
+            seed_plan_data()
+            results = check_query_plans()
+        finally:
+            db.client.drop_database(db)
+    for (name, bad_stages) in results:
+        print("%-24s %s" % (name, ', '.join(sorted(bad_stages)) if bad_stages else 'ok'))
+    if any(bad_stages for (name, bad_stages) in results):
+        sys.exit(1)
+
 if __name__ == "__main__":
     manager.run()
     
\ No newline at end of file
@@ -0,0 +1,61 @@
+import os
+import json
+import boto3
+from botocore.config import Config
+
+from utilities.common import utc_now_ts_ms as now
+
+class FileBackend(object):
+    # writes each message to a json file instead of sending it, for tests and development
+    def __init__(self, root):
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+            
+    def send(self, message):
+        path = os.path.join(self.root, '%d-%s.json' % (now()(), message.id))
+        with open(path, 'w') as f:
+            json.dump({
+                'to': message.to_email,
+                'subject': message.subject,
+                'html': message.body_html,
+                'text': message.body_text,
+                }, f)
+                
+class SESBackend(object):
+    # one client per worker, reused for every message it sends
+    def __init__(self, source, max_connections):
+        self.source = source
+        self.client = boto3.client('ses', config=Config(max_pool_connections=max_connections))
+        
+    def send(self, message):
+        self.client.send_email(
+            Source=self.source,
+            Destination={
+                'ToAddresses': [
+                    message.to_email,
+                ]
+            },
+            Message={
+                'Subject': {
+                    'Data': message.subject,
+                    'Charset': 'UTF-8'
+                },
+                'Body': {
+                    'Text': {
+                        'Data': message.body_text,
+                        'Charset': 'UTF-8'
+                    },
+                    'Html': {
+                        'Data': message.body_html,
+                        'Charset': 'UTF-8'
+                    },
+                }
+            }
+        )
+        
+def mail_backend(app):
+    if app.config.get('MAIL_FILE_SINK'):
+        return FileBackend(app.config.get('MAIL_FILE_SINK'))
+    return SESBackend(app.config.get('MAIL_SOURCE', 'webmaster@fromzero.io'),
+        app.config.get('MAIL_CONNECTIONS', 10))
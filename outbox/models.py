@@ -0,0 +1,33 @@
+from application import db
+from utilities.common import utc_now_ts_ms as now
+
+class OutboxMessage(db.Document):
+    
+    PENDING = 0
+    SENDING = 1
+    SENT = 2
+    FAILED = 3
+    
+    STATUS_TYPE = (
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+        )
+        
+    to_email = db.StringField(db_field="t", required=True)
+    subject = db.StringField(db_field="sj", required=True)
+    body_html = db.StringField(db_field="h")
+    body_text = db.StringField(db_field="bt")
+    status = db.IntField(db_field="s", default=PENDING, choices=STATUS_TYPE)
+    attempts = db.IntField(db_field="a", default=0)
+    run_after = db.LongField(db_field="ra", default=now())
+    locked_until = db.LongField(db_field="lu", default=0)
+    batch = db.StringField(db_field="b", default=None)
+    create_date = db.LongField(db_field="c", default=now())
+    sent_date = db.LongField(db_field="sd", default=None)
+    error = db.StringField(db_field="e", default=None)
+    
+    meta = {
+        'indexes': [('status', 'run_after'), ('status', 'locked_until'), 'batch']
+    }
@@ -0,0 +1,105 @@
+import time
+import uuid
+from flask import current_app
+
+from outbox.models import OutboxMessage
+from outbox.backends import mail_backend
+from utilities.common import utc_now_ts_ms as now
+
+def enqueue(to_email, subject, body_html, body_text):
+    return OutboxMessage(
+        to_email=to_email,
+        subject=subject,
+        body_html=body_html,
+        body_text=body_text
+        ).save()
+        
+def claim_batch(size):
+    # tag up to size due messages with a batch token in one update, then read them back;
+    # messages whose worker died past its lease are picked up again
+    ts = now()()
+    lease_ms = current_app.config.get('MAIL_LEASE_MS', 60000)
+    query = {'$or': [
+        {'s': OutboxMessage.PENDING, 'ra': {'$lte': ts}},
+        {'s': OutboxMessage.SENDING, 'lu': {'$lt': ts}},
+        ]}
+    collection = OutboxMessage._get_collection()
+    ids = [raw['_id'] for raw in collection.find(query, {'_id': 1}).sort('ra', 1).limit(size)]
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    query['_id'] = {'$in': ids}
+    collection.update(query, {
+        '$set': {'s': OutboxMessage.SENDING, 'lu': ts + lease_ms, 'b': token},
+        '$inc': {'a': 1},
+        }, multi=True)
+    return list(OutboxMessage.objects.filter(batch=token))
+    
+class RateLimiter(object):
+    # spaces sends evenly so the worker stays under the provider's per-second quota
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_send = 0
+        
+    def wait(self):
+        if not self.interval:
+            return
+        delay = self.next_send - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_send = max(self.next_send, time.time()) + self.interval
+        
+def deliver_batch(messages, backend, limiter):
+    sent_ids = []
+    for message in messages:
+        limiter.wait()
+        try:
+            backend.send(message)
+        except Exception as e:
+            current_app.logger.exception("email %s to %s failed on attempt %d",
+                message.id, message.to_email, message.attempts)
+            if message.attempts >= current_app.config.get('MAIL_MAX_ATTEMPTS', 5):
+                OutboxMessage.objects(id=message.id).update_one(
+                    set__status=OutboxMessage.FAILED,
+                    set__error=str(e))
+            else:
+                backoff_ms = current_app.config.get('MAIL_BACKOFF_MS', 5000) * 2 ** (message.attempts - 1)
+                OutboxMessage.objects(id=message.id).update_one(
+                    set__status=OutboxMessage.PENDING,
+                    set__run_after=now()() + backoff_ms,
+                    set__error=str(e))
+            continue
+        sent_ids.append(message.id)
+    if sent_ids:
+        OutboxMessage.objects(id__in=sent_ids).update(
+            set__status=OutboxMessage.SENT,
+            set__sent_date=now()(),
+            set__error=None)
+    return len(sent_ids)
+    
+def drain(backend=None, batch_size=None, limiter=None):
+    backend = backend or mail_backend(current_app)
+    batch_size = batch_size or current_app.config.get('MAIL_BATCH_SIZE', 50)
+    limiter = limiter or RateLimiter(current_app.config.get('MAIL_RATE_LIMIT', 14))
+    sent = 0
+    while True:
+        messages = claim_batch(batch_size)
+        if not messages:
+            return sent
+        sent += deliver_batch(messages, backend, limiter)
+        
+def run_mailer(app, batch_size=None):
+    poll_interval = app.config.get('MAIL_POLL_INTERVAL', 1.0)
+    with app.app_context():
+        backend = mail_backend(app)
+        limiter = RateLimiter(app.config.get('MAIL_RATE_LIMIT', 14))
+        app.logger.info("mail worker started")
+        try:
+            while True:
+                sent = drain(backend, batch_size, limiter)
+                if sent:
+                    app.logger.info("mail worker sent %d emails", sent)
+                else:
+                    time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,90 @@
+from application import create_app as create_app_base
+from mongoengine.connection import _get_db
+import unittest
+import os
+import json
+import shutil
+import tempfile
+
+from outbox.models import OutboxMessage
+from outbox.process import claim_batch, deliver_batch, drain, RateLimiter
+from outbox.backends import FileBackend
+
+class FailingBackend(object):
+    def send(self, message):
+        raise IOError("provider unavailable")
+
+class OutboxTest(unittest.TestCase):
+    def create_app(self):
+        self.db_name = 'flaskbook_test'
+        self.sink = tempfile.mkdtemp()
+        return create_app_base(
+            MONGODB_SETTINGS={'DB': self.db_name},
+            TESTING=True,
+            WTF_CSRF_ENABLED=False,
+            SECRET_KEY='mySecret!',
+            MAIL_FILE_SINK=self.sink,
+            MAIL_MAX_ATTEMPTS=2,
+            MAIL_BACKOFF_MS=0,
+            MAIL_RATE_LIMIT=0
+            )
+            
+    def setUp(self):
+        self.app_factory = self.create_app()
+        self.app = self.app_factory.test_client()
+        
+    def tearDown(self):
+        db = _get_db()
+        db.client.drop_database(db)
+        shutil.rmtree(self.sink)
+        
+    def user_dict(self):
+        return dict(
+            first_name="Jorge",
+            last_name="Escobar",
+            username="jorge",
+            email="jorge@example.com",
+            password="test123",
+            confirm="test123"
+            )
+            
+    def test_outbox_delivery(self):
+        # registering only queues the welcome email
+        self.app.post('/register', data=self.user_dict(), follow_redirects=True)
+        assert OutboxMessage.objects.filter(status=OutboxMessage.PENDING).count() == 1
+        assert os.listdir(self.sink) == []
+        
+        # the worker drains it to the file sink
+        with self.app_factory.app_context():
+            assert drain() == 1
+            assert claim_batch(10) == []
+        message = OutboxMessage.objects.first()
+        assert message.status == OutboxMessage.SENT
+        assert message.attempts == 1
+        files = os.listdir(self.sink)
+        assert len(files) == 1
+        with open(os.path.join(self.sink, files[0])) as f:
+            sent = json.load(f)
+        assert sent['to'] == self.user_dict()['email']
+        assert sent['subject'] == "Welcome to Flaskbook"
+        
+    def test_outbox_batches_and_retries(self):
+        with self.app_factory.app_context():
+            for i in range(5):
+                OutboxMessage(to_email="user%d@example.com" % i, subject="Hi",
+                    body_html="<p>Hi</p>", body_text="Hi").save()
+                    
+            # batches don't overlap
+            batch = claim_batch(3)
+            assert len(batch) == 3
+            assert len(claim_batch(3)) == 2
+            assert claim_batch(3) == []
+            
+            # a failed send goes back to pending, then fails for good
+            OutboxMessage.objects.update(set__status=OutboxMessage.PENDING, set__attempts=0)
+            limiter = RateLimiter(0)
+            assert deliver_batch(claim_batch(10), FailingBackend(), limiter) == 0
+            assert OutboxMessage.objects.filter(status=OutboxMessage.PENDING).count() == 5
+            assert deliver_batch(claim_batch(10), FailingBackend(), limiter) == 0
+            assert OutboxMessage.objects.filter(status=OutboxMessage.FAILED).count() == 5
+            assert drain(FileBackend(self.sink), 10, limiter) == 0
@@ -0,0 +1,31 @@
+from user.models import User
+from relationship.models import Relationship
+from feed.maintenance import aggregate
+
+def rebuild_friend_ids(batch_size=1000):
+    # recompute friend_ids and friend_count from the approved relationships, in user _id batches
+    users = User._get_collection()
+    rebuilt = 0
+    last_id = None
+    while True:
+        query = {}
+        if last_id:
+            query['_id'] = {'$gt': last_id}
+        user_ids = [user['_id'] for user in users.find(query, {'_id': 1}).sort('_id', 1).limit(batch_size)]
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+        
+        friends = dict((row['_id'], row['friends']) for row in aggregate([
+            {'$match': {'fu': {'$in': user_ids}, 'rt': Relationship.FRIENDS, 's': Relationship.APPROVED}},
+            {'$sort': {'_id': 1}},
+            {'$group': {'_id': '$fu', 'friends': {'$push': '$tu'}}}
+            ], Relationship))
+            
+        bulk = users.initialize_unordered_bulk_op()
+        for user_id in user_ids:
+            friend_ids = friends.get(user_id, [])
+            bulk.find({'_id': user_id}).update_one({'$set': {'fi': friend_ids, 'fc': len(friend_ids)}})
+        bulk.execute()
+        rebuilt += len(user_ids)
+    return rebuilt
@@ -1,8 +1,13 @@
-from mongoengine import CASCADE
+from mongoengine import CASCADE, Q
 
 from application import db
 from utilities.common import utc_now_ts as now
 from user.models import User
+from utilities.cache import LRUCache, MISSING
+
+# invalidation only reaches this process and the shared tier, so other processes
+# keep their own copy of a state for a few seconds at most
+relationship_cache = LRUCache('relationship', local_ttl=2)
 
 class Relationship(db.Document):
     
@@ -35,33 +40,109 @@ class Relationship(db.Document):
         else:
             return None
 
+    @staticmethod
+    def cache_key(from_user, to_user):
+        return '%s:%s' % (from_user.id, to_user.id)
+        
+    @staticmethod
+    def invalidate(user1, user2):
+        relationship_cache.delete(Relationship.cache_key(user1, user2))
+        relationship_cache.delete(Relationship.cache_key(user2, user1))
+
+    @staticmethod
+    def link_friends(user1, user2):
+        # one atomic update per side, guarded so a repeated call can't count twice
+        users = User._get_collection()
+        for (user_id, friend_id) in ((user1.id, user2.id), (user2.id, user1.id)):
+            users.update({'_id': user_id, 'fi': {'$ne': friend_id}},
+                {'$push': {'fi': friend_id}, '$inc': {'fc': 1}})
+                
+    @staticmethod
+    def unlink_friends(user1, user2):
+        users = User._get_collection()
+        for (user_id, friend_id) in ((user1.id, user2.id), (user2.id, user1.id)):
+            users.update({'_id': user_id, 'fi': friend_id},
+                {'$pull': {'fi': friend_id}, '$inc': {'fc': -1}})
+
     @staticmethod
     def get_relationship(from_user, to_user):
         if from_user == to_user:
             return 'SAME'
-        rel = Relationship.objects.filter(
-            from_user=from_user,
-            to_user=to_user
-            ).first()
-        if rel and rel.rel_type == Relationship.FRIENDS:
-            if rel.status == Relationship.PENDING:
+        key = Relationship.cache_key(from_user, to_user)
+        rel = relationship_cache.get(key)
+        if rel is MISSING:
+            rel = Relationship.query_relationship(from_user, to_user)
+            relationship_cache.set(key, rel)
+        return rel
+        
+    @staticmethod
+    def get_relationships(from_user, to_users):
+        states = {}
+        misses = []
+        for to_user in to_users:
+            if from_user == to_user:
+                states[to_user.id] = 'SAME'
+                continue
+            rel = relationship_cache.get(Relationship.cache_key(from_user, to_user))
+            if rel is MISSING:
+                misses.append(to_user)
+            else:
+                states[to_user.id] = rel
+                
+        # resolve every cache miss, in both directions, with one query
+        if misses:
+            miss_ids = [to_user.id for to_user in misses]
+            forward = {}
+            reverse = {}
+            for rel in Relationship.objects.filter(
+                Q(from_user=from_user, to_user__in=miss_ids) |
+                Q(from_user__in=miss_ids, to_user=from_user)
+                ).only('from_user', 'to_user', 'rel_type', 'status').as_pymongo():
+                if rel['fu'] == from_user.id:
+                    forward.setdefault(rel['tu'], rel)
+                else:
+                    reverse.setdefault(rel['fu'], rel)
+            for to_user in misses:
+                rel = Relationship.resolve(forward.get(to_user.id), reverse.get(to_user.id))
+                relationship_cache.set(Relationship.cache_key(from_user, to_user), rel)
+                states[to_user.id] = rel
+        return states
+        
+    @staticmethod
+    def query_relationship(from_user, to_user):
+        rel = None
+        reverse_rel = None
+        for found in Relationship.objects.filter(
+            Q(from_user=from_user, to_user=to_user) |
+            Q(from_user=to_user, to_user=from_user)
+            ).only('from_user', 'rel_type', 'status').as_pymongo():
+            if found['fu'] == from_user.id:
+                rel = rel or found
+            else:
+                reverse_rel = reverse_rel or found
+        return Relationship.resolve(rel, reverse_rel)
+        
+    @staticmethod
+    def resolve(rel, reverse_rel):
+        # rel and reverse_rel are the raw forward and reverse documents
+        if rel and rel.get('rt') == Relationship.FRIENDS:
+            if rel.get('s') == Relationship.PENDING:
                 return "FRIENDS_PENDING"
-            if rel.status == Relationship.APPROVED:
+            if rel.get('s') == Relationship.APPROVED:
                 return "FRIENDS_APPROVED"
-        elif rel and rel.rel_type == Relationship.BLOCKED:
+        elif rel and rel.get('rt') == Relationship.BLOCKED:
             return "BLOCKED"
         else:
-            reverse_rel = Relationship.objects.filter(
-                from_user=to_user,
-                to_user=from_user
-                ).first()
-            if reverse_rel and reverse_rel.rel_type == Relationship.FRIENDS:
-                if reverse_rel.status == Relationship.PENDING:
+            if reverse_rel and reverse_rel.get('rt') == Relationship.FRIENDS:
+                if reverse_rel.get('s') == Relationship.PENDING:
                     return "REVERSE_FRIENDS_PENDING"
-            elif reverse_rel and reverse_rel.rel_type == Relationship.BLOCKED:
+            elif reverse_rel and reverse_rel.get('rt') == Relationship.BLOCKED:
                 return "REVERSE_BLOCKED"
             return None
 
     meta = {
-        'indexes': [('from_user', 'to_user'), ('from_user', 'to_user', 'rel_type', 'status')]
+        'indexes': [
+            ('from_user', 'to_user', 'rel_type', 'status'),
+            ('from_user', 'rel_type', 'status', '-id')
+        ]
     }
\ No newline at end of file
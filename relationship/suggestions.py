@@ -0,0 +1,172 @@
+import heapq
+import threading
+import time
+from array import array
+from flask import current_app
+from mongoengine import Q
+
+from user.models import User, DISPLAY_EXCLUDE
+from relationship.models import Relationship
+
+FRIENDS = 1
+EXCLUDED = 2
+
+class FriendGraph(object):
+    # user ids are mapped to ints and each user's approved friends kept in an int array;
+    # pairs with a pending request or a block either way are never suggested
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.index = {}
+        self.ids = []
+        self.friends = []
+        self.excluded = {}
+        self.built_at = None
+        self.replay = None
+
+    def node(self, user_id):
+        i = self.index.get(user_id)
+        if i is None:
+            i = len(self.ids)
+            self.index[user_id] = i
+            self.ids.append(user_id)
+            self.friends.append(array('i'))
+        return i
+
+    def add_row(self, from_id, to_id, rel_type, status):
+        a = self.node(from_id)
+        b = self.node(to_id)
+        if rel_type == Relationship.FRIENDS and status == Relationship.APPROVED:
+            # approved friendships are stored as a row in each direction
+            self.friends[a].append(b)
+        else:
+            self.excluded.setdefault(a, set()).add(b)
+            self.excluded.setdefault(b, set()).add(a)
+
+    def set_pair(self, user_id1, user_id2, state):
+        with self.lock:
+            self.apply_pair(user_id1, user_id2, state)
+            if self.replay is not None:
+                # a build is reading the collection and may have passed this pair already
+                self.replay.append((user_id1, user_id2, state))
+                
+    def apply_pair(self, user_id1, user_id2, state):
+        a = self.node(user_id1)
+        b = self.node(user_id2)
+        for (x, y) in ((a, b), (b, a)):
+            if state == FRIENDS:
+                if y not in self.friends[x]:
+                    self.friends[x].append(y)
+            elif y in self.friends[x]:
+                self.friends[x].remove(y)
+            if state == EXCLUDED:
+                self.excluded.setdefault(x, set()).add(y)
+            elif x in self.excluded:
+                self.excluded[x].discard(y)
+
+    def build(self, rows=None):
+        # rows are raw relationship documents; by default the whole collection
+        with self.lock:
+            self.replay = []
+        try:
+            if rows is None:
+                rows = Relationship._get_collection().find({}, {'_id': 0, 'fu': 1, 'tu': 1, 'rt': 1, 's': 1})
+            graph = FriendGraph()
+            for row in rows:
+                graph.add_row(row['fu'], row['tu'], row.get('rt'), row.get('s'))
+            with self.lock:
+                (self.index, self.ids, self.friends, self.excluded) = (
+                    graph.index, graph.ids, graph.friends, graph.excluded)
+                for pair in self.replay:
+                    self.apply_pair(*pair)
+                self.built_at = time.time()
+        finally:
+            with self.lock:
+                self.replay = None
+
+    def stale(self, max_age):
+        return self.built_at is None or time.time() - self.built_at > max_age
+
+    def ensure_current(self, max_age):
+        # rebuilt now and then in a background thread so changes made by other
+        # processes show up too; requests keep reading the current graph meanwhile
+        if self.stale(max_age) and self.build_lock.acquire(False):
+            thread = threading.Thread(target=self.background_build,
+                args=(current_app._get_current_object(),))
+            thread.daemon = True
+            try:
+                thread.start()
+            except Exception:
+                self.build_lock.release()
+                raise
+                
+    def background_build(self, app):
+        try:
+            with app.app_context():
+                self.build()
+        except Exception:
+            app.logger.exception("friend graph build failed")
+        finally:
+            self.build_lock.release()
+
+    def refresh_pair(self, user1, user2):
+        # re-read one pair after a relationship view changed it
+        if self.built_at is None and self.replay is None:
+            return
+        rows = list(Relationship.objects.filter(
+            Q(from_user=user1, to_user=user2) |
+            Q(from_user=user2, to_user=user1)
+            ).only('rel_type', 'status').as_pymongo())
+        if len(rows) == 2 and all(row.get('rt') == Relationship.FRIENDS and
+                row.get('s') == Relationship.APPROVED for row in rows):
+            state = FRIENDS
+        elif rows:
+            state = EXCLUDED
+        else:
+            state = None
+        self.set_pair(user1.id, user2.id, state)
+
+    def suggest(self, user_id, limit=5, max_degree=1000):
+        # rank friends of friends by mutual friend count; friends with more than
+        # max_degree friends are skipped as go-betweens, they say little about a pair.
+        # Held under the lock so a build swap or pair update can't change the arrays mid-walk
+        with self.lock:
+            i = self.index.get(user_id)
+            if i is None:
+                return []
+            friends = self.friends[i]
+            skip = set(friends)
+            skip.add(i)
+            skip.update(self.excluded.get(i, ()))
+            mutual = {}
+            for friend in friends:
+                friends_of_friend = self.friends[friend]
+                if len(friends_of_friend) > max_degree:
+                    continue
+                for j in friends_of_friend:
+                    mutual[j] = mutual.get(j, 0) + 1
+            ranked = heapq.nlargest(limit, ((count, -j) for (j, count) in mutual.items() if j not in skip))
+            return [(self.ids[-j], count) for (count, j) in ranked]
+
+friend_graph = FriendGraph()
+
+def suggest_friends(user, limit=None):
+    # (user, mutual friend count) pairs, best first
+    config = current_app.config
+    if not config.get('SUGGESTIONS_ENABLED'):
+        return []
+    friend_graph.ensure_current(config.get('SUGGESTIONS_REBUILD_SECONDS', 600))
+    limit = limit or config.get('SUGGESTIONS_LIMIT', 5)
+    
+    # the graph only hears of this process's writes, so candidates are checked
+    # against the relationship states and any pair that has one is dropped
+    suggestions = friend_graph.suggest(user.id, limit * 2, config.get('SUGGESTIONS_MAX_DEGREE', 1000))
+    if not suggestions:
+        return []
+    users = User.objects.exclude(*DISPLAY_EXCLUDE).in_bulk([user_id for (user_id, count) in suggestions])
+    states = Relationship.get_relationships(user, list(users.values()))
+    return [(users[user_id], count) for (user_id, count) in suggestions
+        if user_id in users and states.get(user_id) is None][:limit]
@@ -1,10 +1,13 @@
 from application import create_app as create_app_base
 from mongoengine.connection import _get_db
+import time
 import unittest
 from flask import session
 
 from user.models import User
-from relationship.models import Relationship
+from relationship.models import Relationship, relationship_cache
+from relationship.maintenance import rebuild_friend_ids
+from relationship.suggestions import FriendGraph, friend_graph, FRIENDS, EXCLUDED
 
 class RelationshipTest(unittest.TestCase):
     def create_app(self):
@@ -23,6 +26,7 @@ class RelationshipTest(unittest.TestCase):
     def tearDown(self):
         db = _get_db()
         db.client.drop_database(db)
+        friend_graph.reset()
         
     def user1_dict(self):
         return dict(
@@ -44,6 +48,16 @@ class RelationshipTest(unittest.TestCase):
             confirm="test123"
             )
             
+    def user3_dict(self):
+        return dict(
+            first_name="Luis",
+            last_name="Escobar",
+            username="luiti",
+            email="luiti@example.com",
+            password="test123",
+            confirm="test123"
+            )
+            
     def test_friends_operations(self):
         # register users
         rv = self.app.post('/register', data=self.user1_dict(),
@@ -150,4 +164,191 @@ class RelationshipTest(unittest.TestCase):
         # user1 unblocks user2
         rv = self.app.get('/unblock/' + self.user2_dict()['username'],
             follow_redirects=True)
-        assert "relationship-add-friend" in str(rv.data)
\ No newline at end of file
+        assert "relationship-add-friend" in str(rv.data)
+        
+    def test_relationship_cache(self):
+        # register users
+        self.app.post('/register', data=self.user1_dict(),
+            follow_redirects=True)
+        self.app.post('/register', data=self.user2_dict(),
+            follow_redirects=True)
+        user1 = User.objects.get(username=self.user1_dict()['username'])
+        user2 = User.objects.get(username=self.user2_dict()['username'])
+        
+        # the second lookup is served from the cache
+        with self.app_factory.app_context():
+            assert Relationship.get_relationship(user1, user2) == None
+            hits = relationship_cache.stats()['hits']
+            assert Relationship.get_relationship(user1, user2) == None
+            assert relationship_cache.stats()['hits'] == hits + 1
+            
+        # writing through the views invalidates both directions
+        self.app.post('/login', data=dict(
+            username=self.user1_dict()['username'],
+            password=self.user1_dict()['password']
+        ))
+        self.app.get('/add_friend/' + self.user2_dict()['username'],
+            follow_redirects=True)
+        with self.app_factory.app_context():
+            assert Relationship.get_relationship(user1, user2) == "FRIENDS_PENDING"
+            assert Relationship.get_relationship(user2, user1) == "REVERSE_FRIENDS_PENDING"
+            
+        # a write made by another process shows up once the local copy expires
+        with self.app_factory.app_context():
+            relationship_cache.configure(10000, 60, local_ttl=0.1)
+            assert Relationship.get_relationship(user2, user1) == "REVERSE_FRIENDS_PENDING"
+            Relationship(
+                from_user=user2,
+                to_user=user1,
+                rel_type=Relationship.BLOCKED,
+                status=Relationship.APPROVED
+                ).save()
+            assert Relationship.get_relationship(user2, user1) == "REVERSE_FRIENDS_PENDING"
+            time.sleep(0.2)
+            assert Relationship.get_relationship(user2, user1) == "BLOCKED"
+            
+    def test_relationship_batch(self):
+        # register users
+        for user_dict in (self.user1_dict(), self.user2_dict(), self.user3_dict()):
+            self.app.post('/register', data=user_dict, follow_redirects=True)
+        user1 = User.objects.get(username=self.user1_dict()['username'])
+        user2 = User.objects.get(username=self.user2_dict()['username'])
+        user3 = User.objects.get(username=self.user3_dict()['username'])
+        
+        # user2 requests user1's friendship and user3 blocks user1
+        Relationship(
+            from_user=user2,
+            to_user=user1,
+            rel_type=Relationship.FRIENDS,
+            status=Relationship.PENDING
+            ).save()
+        Relationship(
+            from_user=user3,
+            to_user=user1,
+            rel_type=Relationship.BLOCKED,
+            status=Relationship.APPROVED
+            ).save()
+            
+        # the batch lookup matches the single pair lookups
+        with self.app_factory.app_context():
+            states = Relationship.get_relationships(user1, [user1, user2, user3])
+            assert states[user1.id] == "SAME"
+            assert states[user2.id] == "REVERSE_FRIENDS_PENDING"
+            assert states[user3.id] == "REVERSE_BLOCKED"
+            for to_user in (user2, user3):
+                assert Relationship.query_relationship(user1, to_user) == states[to_user.id]
+            
+    def test_friend_ids(self):
+        # register users
+        self.app.post('/register', data=self.user1_dict(),
+            follow_redirects=True)
+        self.app.post('/register', data=self.user2_dict(),
+            follow_redirects=True)
+            
+        # a request doesn't count until it's approved
+        self.app.post('/login', data=dict(
+            username=self.user1_dict()['username'],
+            password=self.user1_dict()['password']
+        ))
+        self.app.get('/add_friend/' + self.user2_dict()['username'])
+        user1 = User.objects.get(username=self.user1_dict()['username'])
+        assert user1.friend_count == 0
+        self.app.post('/login', data=dict(
+            username=self.user2_dict()['username'],
+            password=self.user2_dict()['password']
+        ))
+        self.app.get('/add_friend/' + self.user1_dict()['username'])
+        self.app.get('/add_friend/' + self.user1_dict()['username'])
+        user1 = User.objects.get(id=user1.id)
+        user2 = User.objects.get(username=self.user2_dict()['username'])
+        assert user1.friend_count == 1 and user1.friend_ids == [user2.id]
+        assert user2.friend_count == 1 and user2.friend_ids == [user1.id]
+        
+        # the profile reads the count and friends from the user
+        rv = self.app.get('/' + self.user1_dict()['username'])
+        assert '@' + self.user2_dict()['username'] in str(rv.data)
+        
+        # the friends page reads the friends from the user too, paged on their ids
+        rv = self.app.get('/%s/friends' % self.user1_dict()['username'])
+        assert '@' + self.user2_dict()['username'] in str(rv.data)
+        rv = self.app.get('/%s/friends?before=%s' % (self.user1_dict()['username'], user2.id))
+        assert rv.status_code == 200
+        
+        # the repair command rebuilds the same values
+        User.objects.update(set__friend_count=5, set__friend_ids=[])
+        with self.app_factory.app_context():
+            assert rebuild_friend_ids() == 2
+        assert User.objects.get(id=user1.id).friend_ids == [user2.id]
+        assert User.objects.get(id=user2.id).friend_count == 1
+        
+        # blocking a friend removes them on both sides
+        self.app.get('/block/' + self.user1_dict()['username'])
+        assert User.objects.get(id=user1.id).friend_count == 0
+        assert User.objects.get(id=user2.id).friend_ids == []
+        
+    def test_friend_suggestions(self):
+        # mutual friends rank candidates; pending and blocked pairs are left out
+        graph = FriendGraph()
+        rows = []
+        for (a, b) in ((1, 2), (1, 3), (2, 4), (3, 4), (3, 5), (1, 6), (6, 7)):
+            rows.append({'fu': a, 'tu': b, 'rt': Relationship.FRIENDS, 's': Relationship.APPROVED})
+            rows.append({'fu': b, 'tu': a, 'rt': Relationship.FRIENDS, 's': Relationship.APPROVED})
+        rows.append({'fu': 1, 'tu': 7, 'rt': Relationship.FRIENDS, 's': Relationship.PENDING})
+        graph.build(rows)
+        assert graph.suggest(1) == [(4, 2), (5, 1)]
+        graph.set_pair(1, 5, EXCLUDED)
+        assert graph.suggest(1) == [(4, 2)]
+        graph.set_pair(1, 4, FRIENDS)
+        assert graph.suggest(1) == []
+        assert graph.suggest(1, max_degree=1) == []
+        
+        # a pair changed while a build reads the collection survives the swap
+        def rows_then_cancel():
+            for row in rows:
+                yield row
+            graph.set_pair(1, 7, None)
+        graph.build(rows_then_cancel())
+        assert graph.suggest(1) == [(4, 2), (5, 1), (7, 1)]
+        
+        # register users, make user1 and user3 friends of user2
+        for user_dict in (self.user1_dict(), self.user2_dict(), self.user3_dict()):
+            self.app.post('/register', data=user_dict, follow_redirects=True)
+        for (from_dict, to_dict) in ((self.user1_dict(), self.user2_dict()), (self.user2_dict(), self.user1_dict()),
+                (self.user3_dict(), self.user2_dict()), (self.user2_dict(), self.user3_dict())):
+            self.app.post('/login', data=dict(
+                username=from_dict['username'],
+                password=from_dict['password']
+            ))
+            self.app.get('/add_friend/' + to_dict['username'])
+            
+        # user1 is offered user3 on the home page
+        self.app_factory.config['SUGGESTIONS_ENABLED'] = True
+        with self.app_factory.app_context():
+            friend_graph.build()
+        self.app.post('/login', data=dict(
+            username=self.user1_dict()['username'],
+            password=self.user1_dict()['password']
+        ))
+        rv = self.app.get('/')
+        assert "People you may know" in str(rv.data)
+        assert "@" + self.user3_dict()['username'] in str(rv.data)
+        
+        # a block made in another process is caught by the relationship check
+        user1 = User.objects.get(username=self.user1_dict()['username'])
+        user3 = User.objects.get(username=self.user3_dict()['username'])
+        block = Relationship(
+            from_user=user3,
+            to_user=user1,
+            rel_type=Relationship.BLOCKED,
+            status=Relationship.APPROVED
+            ).save()
+        Relationship.invalidate(user3, user1)
+        rv = self.app.get('/')
+        assert "@" + self.user3_dict()['username'] not in str(rv.data)
+        block.delete()
+        Relationship.invalidate(user3, user1)
+        
+        # sending the request updates the graph in place
+        self.app.get('/add_friend/' + self.user3_dict()['username'])
+        rv = self.app.get('/')
+        assert "People you may know" not in str(rv.data)
@@ -1,7 +1,8 @@
-from flask import Blueprint, abort, session, redirect, url_for, request, render_template
+from flask import Blueprint, abort, session, redirect, url_for, request, render_template, g
 
 from user.models import User
 from relationship.models import Relationship
+from relationship.suggestions import friend_graph
 from user.decorators import login_required
 from utilities.common import email
 
@@ -11,7 +12,7 @@ relationship_app = Blueprint('relationship_app', __name__)
 @login_required
 def add_friend(to_username):
     ref = request.referrer
-    logged_user = User.objects.filter(username=session.get('username')).first()
+    logged_user = g.user
     to_user = User.objects.filter(username=to_username).first()
     
     if to_user:
@@ -29,6 +30,9 @@ def add_friend(to_username):
                 to_user=logged_user)
             reverse_rel.status=Relationship.APPROVED
             reverse_rel.save()
+            Relationship.link_friends(logged_user, to_user)
+            Relationship.invalidate(logged_user, to_user)
+            friend_graph.refresh_pair(logged_user, to_user)
         elif rel == None and rel != "REVERSE_BLOCKED":
             Relationship(
                 from_user=logged_user,
@@ -36,6 +40,8 @@ def add_friend(to_username):
                 rel_type=Relationship.FRIENDS,
                 status=Relationship.PENDING
                 ).save()
+            Relationship.invalidate(logged_user, to_user)
+            friend_graph.refresh_pair(logged_user, to_user)
                 
             # email the user
             body_html = render_template(
@@ -64,7 +70,7 @@ def add_friend(to_username):
 @login_required
 def remove_friend(to_username):
     ref = request.referrer
-    logged_user = User.objects.filter(username=session.get('username')).first()
+    logged_user = g.user
     to_user = User.objects.filter(username=to_username).first()
     
     if to_user:
@@ -77,6 +83,9 @@ def remove_friend(to_username):
             reverse_rel = Relationship.objects.filter(
                 from_user=to_user,
                 to_user=logged_user).delete()
+            Relationship.unlink_friends(logged_user, to_user)
+            Relationship.invalidate(logged_user, to_user)
+            friend_graph.refresh_pair(logged_user, to_user)
         if ref:
             return redirect(ref)
         else:
@@ -88,7 +97,7 @@ def remove_friend(to_username):
 @login_required
 def block(to_username):
     ref = request.referrer
-    logged_user = User.objects.filter(username=session.get('username')).first()
+    logged_user = g.user
     to_user = User.objects.filter(username=to_username).first()
     
     if to_user:
@@ -102,12 +111,15 @@ def block(to_username):
             reverse_rel = Relationship.objects.filter(
                 from_user=to_user,
                 to_user=logged_user).delete()
+            Relationship.unlink_friends(logged_user, to_user)
         Relationship(
             from_user=logged_user,
             to_user=to_user,
             rel_type=Relationship.BLOCKED,
             status=Relationship.APPROVED
             ).save()
+        Relationship.invalidate(logged_user, to_user)
+        friend_graph.refresh_pair(logged_user, to_user)
         if ref:
             return redirect(ref)
         else:
@@ -120,7 +132,7 @@ def block(to_username):
 @login_required
 def unblock(to_username):
     ref = request.referrer
-    logged_user = User.objects.filter(username=session.get('username')).first()
+    logged_user = g.user
     to_user = User.objects.filter(username=to_username).first()
     
     if to_user:
@@ -131,6 +143,8 @@ def unblock(to_username):
             rel = Relationship.objects.filter(
                 from_user=logged_user,
                 to_user=to_user).delete()
+            Relationship.invalidate(logged_user, to_user)
+            friend_graph.refresh_pair(logged_user, to_user)
         if ref:
             return redirect(ref)
         else:
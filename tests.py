@@ -6,6 +6,8 @@ import unittest
 from user.tests import UserTest
 from relationship.tests import RelationshipTest
 from feed.tests import FeedTest
+from jobs.tests import JobTest
+from outbox.tests import OutboxTest
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
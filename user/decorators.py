@@ -1,10 +1,41 @@
 from functools import wraps
-from flask import session, request, redirect, url_for
+from flask import session, request, redirect, url_for, g
+
+from user.models import User, DISPLAY_EXCLUDE
+
+# fields no page needs from the logged in user; the pages that read its friend ids
+# or save it get the fields they need in the same read
+LOGGED_USER_EXCLUDE = DISPLAY_EXCLUDE
+LOGGED_USER_ENDPOINT_EXCLUDE = {
+    'home_app.home': ('password', 'change_configuration'),
+    'user_app.profile': ('password', 'change_configuration'),
+    'user_app.profile-friends': ('password', 'change_configuration'),
+    'feed_app.add_message': ('password', 'change_configuration'),
+    'user_app.edit': (),
+    'user_app.change_password': (),
+}
+
+def load_logged_user():
+    g.user = None
+    if request.endpoint == 'static':
+        return
+    exclude = LOGGED_USER_ENDPOINT_EXCLUDE.get(request.endpoint, LOGGED_USER_EXCLUDE)
+    if session.get('user_id'):
+        g.user = User.objects.filter(
+            id=session.get('user_id')
+            ).exclude(*exclude).first()
+    elif session.get('username'):
+        # sessions started before the user id was stored
+        g.user = User.objects.filter(
+            username=session.get('username')
+            ).exclude(*exclude).first()
+        if g.user:
+            session['user_id'] = str(g.user.id)
 
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if session.get('username') is None:
+        if session.get('username') is None or g.user is None:
             return redirect(url_for('user_app.login', next=request.url))
         return f(*args, **kwargs)
     return decorated_function
\ No newline at end of file
@@ -6,6 +6,19 @@ from application import db
 from utilities.common import utc_now_ts as now
 from settings import STATIC_IMAGE_URL, AWS_BUCKET, AWS_CONTENT_URL
 
+IMAGE_PROCESSING = 'processing'
+IMAGE_READY = 'ready'
+IMAGE_FAILED = 'failed'
+
+# fields no page shows of a user; friend_ids can run to thousands of ids
+DISPLAY_EXCLUDE = ('password', 'change_configuration', 'friend_ids')
+
+IMAGE_STATE = (
+    (IMAGE_PROCESSING, 'Processing'),
+    (IMAGE_READY, 'Ready'),
+    (IMAGE_FAILED, 'Failed'),
+    )
+
 class User(db.Document):
     username = db.StringField(db_field="u", required=True, unique=True)
     password = db.StringField(db_field="p", required=True)
@@ -17,12 +30,18 @@ class User(db.Document):
     email_confirmed = db.BooleanField(db_field="ecf", default=False)
     change_configuration = db.DictField(db_field="cc")
     profile_image = db.StringField(db_field="i", default=None)
+    profile_image_state = db.StringField(db_field="is", default=None, choices=IMAGE_STATE)
+    high_fanout = db.BooleanField(db_field="hf", default=False)
+    feed_horizon = db.LongField(db_field="fh", default=None)
+    friend_count = db.IntField(db_field="fc", default=0)
+    friend_ids = db.ListField(db.ObjectIdField(), db_field="fi")
     
     @classmethod
     def pre_save(cls, sender, document, **kwargs):
         document.username = document.username.lower()
         document.email = document.email.lower()
         
+        
     def profile_imgsrc(self, size):
         if self.profile_image:
             if AWS_BUCKET:
@@ -0,0 +1,36 @@
+import hmac
+import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+
+class PasswordHasher(object):
+    # bcrypt runs on a small bounded pool so a burst of logins queues up there
+    # instead of tying up every request worker's CPU at once
+    def __init__(self):
+        self.rounds = 12
+        self.executor = None
+        
+    def init_app(self, app):
+        self.configure(app.config.get('BCRYPT_LOG_ROUNDS', 12),
+            app.config.get('PASSWORD_WORKERS', 2))
+            
+    def configure(self, rounds, workers=2):
+        if self.executor:
+            self.executor.shutdown(wait=False)
+        self.rounds = rounds
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        
+    def hash(self, password):
+        return self.executor.submit(bcrypt.hashpw, password, bcrypt.gensalt(self.rounds)).result()
+        
+    def verify(self, password, hashed):
+        candidate = self.executor.submit(bcrypt.hashpw, password, hashed).result()
+        return hmac.compare_digest(candidate, hashed)
+        
+    def needs_rehash(self, hashed):
+        # bcrypt hashes look like $2a$<rounds>$<salt and hash>
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+            
+passwords = PasswordHasher()
@@ -0,0 +1,14 @@
+from user.models import User, IMAGE_READY, IMAGE_FAILED
+from utilities.imaging import thumbnail_process, discard_uploads
+
+def profile_image_job(payload):
+    user = User.objects.filter(id=payload.get('user_id')).first()
+    if user:
+        User.objects(id=user.id).update_one(
+            set__profile_image=str(thumbnail_process(payload.get('file'), 'user', str(user.id))),
+            set__profile_image_state=IMAGE_READY)
+    discard_uploads([payload.get('file')])
+    
+def profile_image_failed(payload):
+    User.objects(id=payload.get('user_id')).update_one(set__profile_image_state=IMAGE_FAILED)
+    discard_uploads([payload.get('file')])
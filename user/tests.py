@@ -4,6 +4,7 @@ import unittest
 from flask import session
 
 from user.models import User
+from user.passwords import passwords
 
 class UserTest(unittest.TestCase):
     def create_app(self):
@@ -13,6 +14,7 @@ class UserTest(unittest.TestCase):
             TESTING=True,
             WTF_CSRF_ENABLED=False,
             SECRET_KEY='mySecret',
+            BCRYPT_LOG_ROUNDS=4,
             )
         
     def setUp(self):
@@ -78,6 +80,25 @@ class UserTest(unittest.TestCase):
         with self.app as c:
             rv = c.get('/')
             assert session.get('username') == self.user_dict()['username']
+            assert session.get('user_id') == str(User.objects.get(username=self.user_dict()['username']).id)
+        
+    def test_password_rehash(self):
+        # create a user with the current work factor
+        self.app.post('/register', data=self.user_dict())
+        user = User.objects.get(username=self.user_dict()['username'])
+        assert not passwords.needs_rehash(user.password)
+        
+        # raise the work factor and login: the stored hash is upgraded
+        passwords.configure(5)
+        assert passwords.needs_rehash(user.password)
+        rv = self.app.post('/login', data=dict(
+            username=self.user_dict()['username'],
+            password=self.user_dict()['password']
+            ))
+        user = User.objects.get(username=self.user_dict()['username'])
+        assert user.password.split('$')[2] == '05'
+        assert passwords.verify(self.user_dict()['password'], user.password)
+        assert not passwords.verify('wrong', user.password)
         
     def test_edit_profile(self):
         # create a user
@@ -1,28 +1,29 @@
-from flask import Blueprint, render_template, request, redirect, session, url_for, abort
-import bcrypt
+from flask import Blueprint, render_template, request, redirect, session, url_for, abort, current_app, g
 import uuid
-import os
-from werkzeug import secure_filename
-from mongoengine import Q
 
-from user.models import User
+from user.models import User, IMAGE_PROCESSING, DISPLAY_EXCLUDE
 from user.forms import RegisterForm, LoginForm, EditForm, ForgotForm, PasswordResetForm
+from user.passwords import passwords
 from utilities.common import email
-from settings import UPLOAD_FOLDER
-from utilities.imaging import thumbnail_process
+from utilities.imaging import stage_upload, discard_uploads, thumbnail_process
 from relationship.models import Relationship
-from user.decorators import login_required
+from user.decorators import login_required, load_logged_user
 from feed.forms import FeedPostForm
 from feed.models import Message, POST
+from jobs.models import PROFILE_IMAGE
+from jobs.process import enqueue
+from feed.prefetch import prefetch_messages
+from utilities.pagination import keyset_query, keyset_exists, decode_cursor, KeysetPage
 
 user_app = Blueprint('user_app', __name__)
+
+user_app.before_app_request(load_logged_user)
     
 @user_app.route('/register', methods=('GET', 'POST'))
 def register():
     form = RegisterForm()
     if form.validate_on_submit():
-        salt = bcrypt.gensalt()
-        hashed_password = bcrypt.hashpw(form.password.data, salt)
+        hashed_password = passwords.hash(form.password.data)
         code = str(uuid.uuid4())
         user = User(
             username=form.username.data,
@@ -58,8 +59,13 @@ def login():
             username=form.username.data
             ).first()
         if user:
-            if bcrypt.hashpw(form.password.data, user.password) == user.password:
+            if passwords.verify(form.password.data, user.password):
+                # upgrade hashes stored with an old work factor while we have the password
+                if passwords.needs_rehash(user.password):
+                    User.objects(id=user.id).update_one(
+                        set__password=passwords.hash(form.password.data))
                 session['username'] = form.username.data
+                session['user_id'] = str(user.id)
                 if 'next' in session:
                     next = session.get('next')
                     session.pop('next')
@@ -75,51 +81,77 @@ def login():
 @user_app.route('/logout')
 def logout():
     session.pop('username')
+    session.pop('user_id', None)
     return redirect(url_for('user_app.login'))
 
-@user_app.route('/<username>/friends/<int:friends_page_number>', endpoint='profile-friends-page')
 @user_app.route('/<username>/friends', endpoint='profile-friends')    
 @user_app.route('/<username>')
-def profile(username, friends_page_number=1):
+def profile(username):
     logged_user = None
     rel = None
     friends_page = False
-    user = User.objects.filter(username=username).first()
-    profile_messages = []
+    if g.user and g.user.username == username:
+        user = g.user
+    else:
+        user = User.objects.filter(username=username).first()
+    profile_messages = None
+    before = request.args.get('before')
+    after = request.args.get('after')
     
     if user:
-        if session.get('username'):
-            logged_user = User.objects.filter(username=session.get('username')).first()
+        if g.user:
+            logged_user = g.user
             rel = Relationship.get_relationship(logged_user, user)
 
-        # get friends
-        friends = Relationship.objects.filter(
-            from_user=user,
-            rel_type=Relationship.FRIENDS,
-            status=Relationship.APPROVED
-            )
-        friends_total = friends.count()
+        # friends are kept on the user document
+        friends_total = user.friend_count
         
+        friend_states = {}
         if 'friends' in request.url:
             friends_page = True
-            friends = friends.paginate(page=friends_page_number, per_page=3)
+            # page over the friend ids, newest first, keyed on the friend's id
+            friend_ids = user.friend_ids[::-1]
+            positions = dict((friend_id, i) for (i, friend_id) in enumerate(friend_ids))
+            cursor = decode_cursor(after or before, 1)
+            position = positions.get(cursor[0]) if cursor else None
+            if position is None:
+                # no cursor, or the friend it points at is gone: start from the newest
+                (cursor, before, after) = (None, None, None)
+            if after is not None:
+                rows = friend_ids[:position or 0][::-1][:4]
+            else:
+                rows = friend_ids[position + 1 if position is not None else 0:][:4]
+            friends = KeysetPage(rows, 3, lambda friend_id: (friend_id,), before, after,
+                lambda key: positions.get(key[0], len(friend_ids)) < len(friend_ids) - 1, cursor)
+            friend_users = User.objects.exclude(*DISPLAY_EXCLUDE).in_bulk(friends.items)
+            friends.items = [friend_users[friend_id] for friend_id in friends.items if friend_id in friend_users]
+            if logged_user:
+                friend_states = Relationship.get_relationships(logged_user, friends.items)
         else:
-            friends = friends[:5]
+            # the five newest friends, in one query
+            friend_ids = user.friend_ids[-5:][::-1]
+            friend_users = User.objects.exclude(*DISPLAY_EXCLUDE).in_bulk(friend_ids)
+            friends = [friend_users[friend_id] for friend_id in friend_ids if friend_id in friend_users]
         
         form = FeedPostForm()
         
-        # get user messages if friends or self
-        if logged_user and (rel == "SAME" or rel == "FRIENDS_APPROVED"):
-            profile_messages = Message.objects.filter(
-                Q(from_user=user) | Q(to_user=user),
-                message_type=POST
-                ).order_by('-create_date')[:10]
+        # get user messages if friends or self; the friends page doesn't show them
+        if not friends_page and logged_user and (rel == "SAME" or rel == "FRIENDS_APPROVED"):
+            branches = [{'from_user': user, 'message_type': POST}, {'to_user': user, 'message_type': POST}]
+            cursor = decode_cursor(after or before, 2)
+            profile_messages = KeysetPage(list(keyset_query(Message,
+                branches, ('create_date', 'id'), cursor, after is not None
+                ).as_pymongo()[:11]),
+                10, lambda message: (message['c'], message['_id']), before, after,
+                lambda key: keyset_exists(Message, branches, ('create_date', 'id'), key), cursor)
+            profile_messages.items = prefetch_messages(profile_messages.items)
         
         return render_template('user/profile.html', 
             user=user, 
             logged_user=logged_user,
             rel=rel,
             friends=friends,
+            friend_states=friend_states,
             friends_total=friends_total,
             friends_page=friends_page,
             form=form,
@@ -133,17 +165,10 @@ def profile(username, friends_page_number=1):
 def edit():
     error = None
     message = None
-    user = User.objects.filter(username=session.get('username')).first()
+    user = g.user
     if user:
         form = EditForm(obj=user)
         if form.validate_on_submit():
-            # check if image
-            image_ts = None
-            if request.files.get('image'):
-                filename = secure_filename(form.image.data.filename)
-                file_path = os.path.join(UPLOAD_FOLDER, 'user', filename)
-                form.image.data.save(file_path)
-                image_ts = str(thumbnail_process(file_path, 'user', str(user.id)))
             if user.username != form.username.data.lower():
                 if User.objects.filter(username=form.username.data.lower()).first():
                     error = "Username already exists"
@@ -170,10 +195,20 @@ def edit():
                     email(user.change_configuration['new_email'], "Confirm your new email", body_html, body_text)
                     
             if not error:
+                # the image is only staged once the rest of the form is valid
+                file_path = None
+                if request.files.get('image'):
+                    file_path = stage_upload(form.image.data, 'user')
                 form.populate_obj(user)
-                if image_ts:
-                    user.profile_image = image_ts
+                if file_path and current_app.config.get('IMAGE_ASYNC'):
+                    user.profile_image_state = IMAGE_PROCESSING
+                elif file_path:
+                    user.profile_image = str(thumbnail_process(file_path, 'user', str(user.id)))
                 user.save()
+                if file_path and current_app.config.get('IMAGE_ASYNC'):
+                    enqueue(PROFILE_IMAGE, {'user_id': str(user.id), 'file': file_path})
+                else:
+                    discard_uploads([file_path])
                 if not message:
                     message = "Profile updated"
     
@@ -230,14 +265,13 @@ def password_reset(username, code):
     if request.method == 'POST':
         del form.current_password
         if form.validate_on_submit():
-            salt = bcrypt.gensalt()
-            hashed_password = bcrypt.hashpw(form.password.data, salt)
-            user.password = hashed_password
+            user.password = passwords.hash(form.password.data)
             user.change_configuration = {}
             user.save()
             
             if session.get('username'):
                 session.pop('username')
+                session.pop('user_id', None)
             return redirect(url_for('user_app.password_reset_complete'))
             
     return render_template('user/password_reset.html',
@@ -258,21 +292,20 @@ def change_password():
     error = None
     form = PasswordResetForm()
     
-    user = User.objects.filter(username=session.get('username')).first()
+    user = g.user
     
     if not user:
         abort(404)
         
     if request.method == 'POST':
         if form.validate_on_submit():
-            if bcrypt.hashpw(form.current_password.data, user.password) == user.password:
-                salt = bcrypt.gensalt()
-                hashed_password = bcrypt.hashpw(form.password.data, salt)
-                user.password = hashed_password
+            if passwords.verify(form.current_password.data, user.password):
+                user.password = passwords.hash(form.password.data)
                 user.save()
                 # if user is logged in, log him out
                 if session.get('username'):
                     session.pop('username')
+                    session.pop('user_id', None)
                 return redirect(url_for('user_app.password_reset_complete'))
             else:
                 error = "Incorrect password"
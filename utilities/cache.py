@@ -0,0 +1,135 @@
+import time
+import threading
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+MISSING = object()
+
+caches = OrderedDict()
+
+def cache_stats():
+    return dict((name, cache.stats()) for (name, cache) in caches.items())
+    
+class RedisTier(object):
+    # values are stored as strings, with None kept as an empty string
+    def __init__(self, url, prefix, ttl):
+        if redis is None:
+            raise RuntimeError("The redis package is required for a shared cache tier")
+        self.client = redis.StrictRedis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+        
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return MISSING
+        return value.decode('utf-8') or None
+        
+    def set(self, key, value):
+        self.client.setex(self.prefix + key, self.ttl, value or '')
+        
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+class LRUCache(object):
+    # with maxbytes set, values must be strings and are also evicted by their total encoded size;
+    # local_ttl bounds how long this process keeps an entry that another process may
+    # have invalidated, the shared tier keeps it for the full ttl
+    def __init__(self, name, maxsize=10000, ttl=60, maxbytes=None, local_ttl=None):
+        self.name = name
+        self.lock = threading.Lock()
+        self.shared = None
+        self.default_local_ttl = local_ttl
+        self.configure(maxsize, ttl, maxbytes=maxbytes, local_ttl=local_ttl)
+        caches[name] = self
+        
+    def configure(self, maxsize, ttl, shared=None, maxbytes=None, local_ttl=None):
+        with self.lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self.local_ttl = min(ttl, local_ttl) if local_ttl else ttl
+            self.maxbytes = maxbytes
+            self.shared = shared
+            self.entries = OrderedDict()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.shared_hits = 0
+            
+    def init_app(self, app, prefix):
+        shared = None
+        if app.config.get(prefix + '_REDIS_URL'):
+            shared = RedisTier(app.config.get(prefix + '_REDIS_URL'), self.name + ':',
+                app.config.get(prefix + '_TTL', self.ttl))
+        self.configure(
+            app.config.get(prefix + '_SIZE', self.maxsize),
+            app.config.get(prefix + '_TTL', self.ttl),
+            shared,
+            app.config.get(prefix + '_MAXBYTES', self.maxbytes),
+            app.config.get(prefix + '_LOCAL_TTL', self.default_local_ttl))
+            
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[1] > time.time():
+                # re-inserting moves the key to the recent end (move_to_end is python 3 only)
+                self.entries[key] = self.entries.pop(key)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                self._remove(key)
+        if self.shared:
+            value = self.shared.get(key)
+            if value is not MISSING:
+                with self.lock:
+                    self.shared_hits += 1
+                self._set_local(key, value)
+                return value
+        with self.lock:
+            self.misses += 1
+        return MISSING
+        
+    def set(self, key, value):
+        self._set_local(key, value)
+        if self.shared:
+            self.shared.set(key, value)
+            
+    def _set_local(self, key, value):
+        if not self.maxsize:
+            return
+        with self.lock:
+            self._remove(key)
+            size = len(value.encode('utf-8')) if self.maxbytes else 0
+            self.entries[key] = (value, time.time() + self.local_ttl, size)
+            self.bytes += size
+            while len(self.entries) > self.maxsize or (self.maxbytes and self.bytes > self.maxbytes):
+                self._remove(next(iter(self.entries)))
+                
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.bytes -= entry[2]
+            
+    def delete(self, key):
+        with self.lock:
+            self._remove(key)
+        if self.shared:
+            self.shared.delete(key)
+            
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'bytes': self.bytes,
+                'maxbytes': self.maxbytes,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                }
@@ -1,5 +1,5 @@
 import time
-import boto3
+import bisect
 from flask import current_app
 import datetime
 import arrow
@@ -15,37 +15,53 @@ def ms_stamp_humanize(ts):
     ts = datetime.datetime.fromtimestamp(ts/1000.0)
     return arrow.get(ts).humanize()
     
+# arrow's humanize buckets: (upper bound in seconds, text, seconds per unit for plurals)
+HUMANIZE_BUCKETS = (
+    (10, 'just now', None),
+    (45, 'seconds', None),
+    (90, 'a minute', None),
+    (2700, '%d minutes', 60),
+    (5400, 'an hour', None),
+    (79200, '%d hours', 3600),
+    (129600, 'a day', None),
+    (2592000, '%d days', 86400),
+    (3888000, 'a month', None),
+    (29808000, '%d months', 2592000),
+    (47260800, 'a year', None),
+    (float('inf'), '%d years', 31536000),
+    )
+HUMANIZE_BOUNDS = [bucket[0] for bucket in HUMANIZE_BUCKETS]
+
+def ms_stamps_humanize(stamps, now_ms=None):
+    # one shared "now" for the whole batch and no per-item datetime objects
+    now_ms = now_ms or utc_now_ts_ms()()
+    humanized = []
+    for ts in stamps:
+        delta = int((now_ms - ts) / 1000)
+        diff = abs(delta)
+        (bound, text, unit) = HUMANIZE_BUCKETS[bisect.bisect_right(HUMANIZE_BOUNDS, diff)]
+        if unit:
+            text = text % max(diff // unit, 2)
+        if diff < 10:
+            humanized.append(text)
+        elif delta >= 0:
+            humanized.append(text + ' ago')
+        else:
+            humanized.append('in ' + text)
+    return humanized
+    
+def ms_stamp_iso(ts):
+    return datetime.datetime.utcfromtimestamp(ts/1000.0).strftime('%Y-%m-%dT%H:%M:%SZ')
+    
 def linkify(text):
     text = bleach.clean(text, tags=[], attributes={}, styles=[], strip=True)
     return bleach.linkify(text)
     
 def email(to_email, subject, body_html, body_text):
-    # don't run this if we're running a test or setting is False
-    if current_app.config.get('TESTING') or not current_app.config.get('AWS_SEND_MAIL'):
+    # don't queue anything if there's nowhere to deliver it
+    if not current_app.config.get('AWS_SEND_MAIL') and not current_app.config.get('MAIL_FILE_SINK'):
         return False
-
-    client = boto3.client('ses')
-    return client.send_email(
-        Source='webmaster@fromzero.io',
-            Destination={
-                'ToAddresses': [
-                    to_email,
-                ]
-            },
-        Message={
-            'Subject': {
-                'Data': subject,
-                'Charset': 'UTF-8'
-            },
-            'Body': {
-                'Text': {
-                    'Data': body_text,
-                    'Charset': 'UTF-8'
-                },
-                'Html': {
-                    'Data': body_html,
-                    'Charset': 'UTF-8'
-                },                
-            }
-        }
-    )
\ No newline at end of file
+        
+    # the mail worker sends it, so the request never waits on the provider
+    from outbox.process import enqueue
+    return enqueue(to_email, subject, body_html, body_text)
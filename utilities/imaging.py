@@ -1,50 +1,69 @@
 from wand.image import Image
 import os
-import boto3
-from boto3.s3.transfer import S3Transfer
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug import secure_filename
 
 from utilities.common import utc_now_ts as now, utc_now_ts_ms as now_ms
-from settings import UPLOAD_FOLDER, AWS_BUCKET
+from utilities.storage import storage
 
-def thumbnail_process(file, content_type, content_id, sizes=[("sm", 50), ("lg", 75), ("xlg", 200)]):
-    image_id = now()
-    filename_template = content_id + '.%s.%s.png'
+executor = None
+
+def image_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=current_app.config.get('IMAGE_WORKERS', 4))
+    return executor
+
+def stage_upload(file, content_type):
+    # uploads wait for their job under a unique name, so two files sent with the
+    # same name can't overwrite each other
+    folder = os.path.join(current_app.config.get('UPLOAD_FOLDER'), content_type)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    file_path = os.path.join(folder, '%s.%s' % (uuid.uuid4().hex, secure_filename(file.filename)))
+    file.save(file_path)
+    return file_path
     
-    # original
+def discard_uploads(files):
+    # only once every derivative is stored and recorded, so a retry still has its source
+    for file in files:
+        if file and os.path.exists(file):
+            os.remove(file)
+            
+def thumbnail_images(file, sizes):
+    # decode and crop once, then derive every size from the in-memory image
+    images = []
     with Image(filename=file) as img:
         crop_center(img)
         img.format = 'png'
-        img.save(filename=os.path.join(UPLOAD_FOLDER, content_type, filename_template % (image_id, 'raw')))
-        
-    # sizes
-    for (name, size) in sizes:
-        with Image(filename=file) as img:
-            crop_center(img)
-            img.sample(size, size)
-            img.format = 'png'
-            img.save(filename=os.path.join(UPLOAD_FOLDER, content_type, filename_template % (image_id, name)))
-
-    if AWS_BUCKET:
-        s3 = boto3.client('s3')
-        transfer = S3Transfer(s3)
-        transfer.upload_file(
-            os.path.join(UPLOAD_FOLDER, content_type, filename_template % (image_id, 'raw')), 
-            AWS_BUCKET, 
-            os.path.join(content_type, filename_template % (image_id, 'raw')),
-            extra_args={'ACL': 'public-read', 'ContentType': 'image/png'}
-            )
-        os.remove(os.path.join(UPLOAD_FOLDER, content_type, filename_template % (image_id, 'raw')))
-
+        images.append(('raw', img.make_blob()))
         for (name, size) in sizes:
-            transfer.upload_file(
-                os.path.join(UPLOAD_FOLDER, content_type, filename_template % (image_id, name)), 
-                AWS_BUCKET, 
-                os.path.join(content_type, filename_template % (image_id, name)),
-                extra_args={'ACL': 'public-read', 'ContentType': 'image/png'}
-                )
-            os.remove(os.path.join(UPLOAD_FOLDER, content_type, filename_template % (image_id, name)))
+            with img.clone() as sized:
+                sized.sample(size, size)
+                images.append((name, sized.make_blob()))
+    return images
+    
+def height_images(file, height):
+    with Image(filename=file) as img:
+        img.format = 'png'
+        raw = img.make_blob()
+        with img.clone() as resized:
+            resized.transform(resize='x' + str(height))
+            return ([('raw', raw), ('xlg', resized.make_blob())], resized.width)
+            
+def store_images(images, content_type, filename_template, image_id):
+    storage.put_many([
+        (os.path.join(content_type, filename_template % (image_id, name)), blob, 'image/png')
+        for (name, blob) in images
+        ])
 
-    os.remove(file)
+def thumbnail_process(file, content_type, content_id, sizes=[("sm", 50), ("lg", 75), ("xlg", 200)]):
+    image_id = now()
+    filename_template = content_id + '.%s.%s.png'
+    
+    store_images(thumbnail_images(file, sizes), content_type, filename_template, image_id)
     return image_id
     
 def crop_center(image):
@@ -57,42 +76,18 @@ def crop_center(image):
         height=int(wh)
     )
     
-def image_height_transform(file, content_type, content_id, height=200):
-    image_id = now_ms()()
+def image_height_transform(file, content_type, content_id, height=200, image_id=None):
+    image_id = image_id or now_ms()()
     filename_template = content_id + '.%s.%s.png'
 
-    # original
-    with Image(filename=file) as img:
-        img.format = 'png'
-        img.save(filename=os.path.join(UPLOAD_FOLDER, content_type, filename_template % (image_id, 'raw')))
-
-    # resized
-    img_width = None
-    with Image(filename=file) as img:
-        img.transform(resize='x' + str(height))
-        img.format = 'png'
-        img.save(filename=os.path.join(UPLOAD_FOLDER, content_type, filename_template % (image_id, 'xlg')))
-        img_width = img.width
-        
-    if AWS_BUCKET:
-        s3 = boto3.client('s3')
-        transfer = S3Transfer(s3)
-        transfer.upload_file(
-            os.path.join(UPLOAD_FOLDER, content_type, filename_template % (image_id, 'raw')), 
-            AWS_BUCKET, 
-            os.path.join(content_type, filename_template % (image_id, 'raw')),
-            extra_args={'ACL': 'public-read', 'ContentType': 'image/png'}
-            )
-        os.remove(os.path.join(UPLOAD_FOLDER, content_type, filename_template % (image_id, 'raw')))
-
-        transfer.upload_file(
-            os.path.join(UPLOAD_FOLDER, content_type, filename_template % (image_id, 'xlg')), 
-            AWS_BUCKET, 
-            os.path.join(content_type, filename_template % (image_id, 'xlg')),
-            extra_args={'ACL': 'public-read', 'ContentType': 'image/png'}
-            )
-        os.remove(os.path.join(UPLOAD_FOLDER, content_type, filename_template % (image_id, 'xlg')))
-
-    os.remove(file)
+    (images, img_width) = height_images(file, height)
+    store_images(images, content_type, filename_template, image_id)
 
     return (image_id, img_width)
+    
+def post_images_process(files, content_type, content_id, height=200):
+    # each image gets its own timestamp id so parallel runs can't collide
+    image_id = now_ms()()
+    futures = [image_executor().submit(image_height_transform, file, content_type, content_id, height, image_id + i)
+        for (i, file) in enumerate(files)]
+    return [{"ts": str(ts), "w": str(width)} for (ts, width) in [future.result() for future in futures]]
@@ -0,0 +1,62 @@
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from flask import abort
+from mongoengine import Q
+
+def encode_cursor(key):
+    return '_'.join(str(value) for value in key)
+    
+def decode_cursor(cursor, size):
+    # every part but the last is an integer, the last one an ObjectId;
+    # a cursor that doesn't parse is a bad request rather than some other page
+    if not cursor:
+        return None
+    parts = cursor.split('_')
+    if len(parts) != size:
+        abort(400)
+    try:
+        return tuple(int(part) for part in parts[:-1]) + (ObjectId(parts[-1]),)
+    except (ValueError, InvalidId):
+        abort(400)
+        
+def keyset_query(document, branches, fields, cursor=None, newer=False):
+    # each branch is a dict of equality filters; the cursor predicate is
+    # expanded into every branch so each $or clause can walk its own index
+    op = 'gt' if newer else 'lt'
+    query = None
+    for branch in branches:
+        parts = [{}]
+        if cursor:
+            parts = []
+            for i in range(len(fields)):
+                part = dict(zip(fields[:i], cursor[:i]))
+                part[fields[i] + '__' + op] = cursor[i]
+                parts.append(part)
+        for part in parts:
+            clause = Q(**dict(branch, **part))
+            query = clause if query is None else query | clause
+    order = '' if newer else '-'
+    return document.objects.filter(query).order_by(*[order + field for field in fields])
+    
+def keyset_exists(document, branches, fields, cursor):
+    # whether anything sorts before the cursor
+    return keyset_query(document, branches, fields, cursor).only(fields[0]).as_pymongo().first() is not None
+    
+class KeysetPage(object):
+    # rows were fetched with one extra to tell if there are more, in query order;
+    # a page read with after only sees newer rows, so older(key) is asked whether
+    # anything sorts before its oldest item, or before the cursor when it's empty
+    def __init__(self, rows, per_page, key, before=None, after=None, older=None, cursor=None):
+        newer = after is not None
+        more = len(rows) > per_page
+        self.items = list(rows[:per_page])
+        if newer:
+            self.items.reverse()
+        self.has_newer = more if newer else before is not None
+        if newer:
+            oldest = key(self.items[-1]) if self.items else cursor
+            self.has_older = bool(oldest and older and older(oldest))
+        else:
+            self.has_older = more
+        self.newer = encode_cursor(key(self.items[0])) if self.items else (after or before)
+        self.older = encode_cursor(key(self.items[-1])) if self.items else (after or before)
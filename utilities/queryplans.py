@@ -0,0 +1,116 @@
+from mongoengine import Q
+
+from user.models import User
+from relationship.models import Relationship
+from relationship.maintenance import rebuild_friend_ids
+from feed.models import Message, Feed, FeedBucket, POST, COMMENT, LIKE
+from utilities.pagination import keyset_query
+from utilities.common import utc_now_ts_ms as now
+
+def seed_plan_data(users=20, posts=5):
+    # just enough documents for the planner to pick between indexes; the indexes
+    # are only built on first use, so rebuild them in case the database was dropped
+    for document in (User, Relationship, Message, Feed, FeedBucket):
+        document.ensure_indexes()
+    user_ids = User._get_collection().insert([
+        {'u': 'plan%d' % i, 'e': 'plan%d@example.com' % i, 'p': 'x', 'fn': 'Plan'}
+        for i in range(users)
+        ])
+    rels = []
+    for i, user_id in enumerate(user_ids):
+        friend_id = user_ids[(i + 1) % users]
+        rels.append({'fu': user_id, 'tu': friend_id, 'rt': Relationship.FRIENDS, 's': Relationship.APPROVED})
+        rels.append({'fu': friend_id, 'tu': user_id, 'rt': Relationship.FRIENDS, 's': Relationship.APPROVED})
+    Relationship._get_collection().insert(rels)
+    rebuild_friend_ids()
+    
+    ts = now()()
+    messages = Message._get_collection()
+    feeds = []
+    for i, user_id in enumerate(user_ids):
+        for j in range(posts):
+            create_date = ts - (i * posts + j) * 1000
+            message_id = messages.insert({'fu': user_id, 'tu': user_ids[(i + 1) % users],
+                't': 'Post %d' % j, 'mt': POST, 'c': create_date})
+            messages.insert([
+                {'fu': user_ids[(i + 1) % users], 't': 'Comment', 'mt': COMMENT, 'p': message_id, 'c': create_date + 1},
+                {'fu': user_ids[(i + 1) % users], 'tu': user_id, 'mt': LIKE, 'p': message_id, 'c': create_date + 2},
+                ])
+            feeds.append({'u': user_ids[(i + 1) % users], 'm': message_id, 'c': create_date})
+    Feed._get_collection().insert(feeds)
+    FeedBucket._get_collection().insert([
+        {'u': feed['u'], 'e': [{'m': feed['m'], 'c': feed['c']}], 'n': 1, 'f': feed['c'], 'l': feed['c']}
+        for feed in feeds
+        ])
+    return user_ids
+    
+def canonical_queries():
+    # the query shapes the views and jobs run, built the same way they build them
+    user = User.objects.first()
+    friend = User.objects.filter(id__ne=user.id).first()
+    message = Message.objects.filter(from_user=user, message_type=POST).first()
+    message_cursor = (message.create_date, message.id)
+    feed = Feed.objects.filter(user=friend).first()
+    
+    return [
+        ('login', User.objects.filter(username=user.username)),
+        ('register email check', User.objects.filter(email=user.email)),
+        ('relationship', Relationship.objects.filter(
+            Q(from_user=user, to_user=friend) | Q(from_user=friend, to_user=user))),
+        ('relationship batch', Relationship.objects.filter(
+            Q(from_user=user, to_user__in=[friend.id]) | Q(from_user__in=[friend.id], to_user=user))),
+        ('friend ids', Relationship.objects.filter(
+            from_user=user, rel_type=Relationship.FRIENDS, status=Relationship.APPROVED).only('to_user')),
+        ('fan-out blocks', Relationship.objects.filter(
+            from_user__in=[friend.id], to_user=user, rel_type=Relationship.BLOCKED)),
+        ('home feed', keyset_query(Feed, [{'user': friend}], ('create_date', 'message'))[:11]),
+        ('home feed older', keyset_query(Feed, [{'user': friend}], ('create_date', 'message'),
+            (feed.create_date, feed.message.id))[:11]),
+        ('bucket push check', FeedBucket.objects.filter(
+            user__in=[friend.id], entries__m=feed.message.id).only('user')),
+        ('pulled posts', keyset_query(Message, [{'from_user': user, 'message_type': POST}],
+            ('create_date', 'id'), message_cursor)[:11]),
+        ('past horizon posts', keyset_query(Message,
+            [{'from_user': author_id, 'message_type': POST} for author_id in [user.id] + user.friend_ids],
+            ('create_date', 'id'), message_cursor)[:11]),
+        ('profile messages', keyset_query(Message,
+            [{'from_user': user, 'message_type': POST}, {'to_user': user, 'message_type': POST}],
+            ('create_date', 'id'))[:11]),
+        ('profile messages older', keyset_query(Message,
+            [{'from_user': user, 'message_type': POST}, {'to_user': user, 'message_type': POST}],
+            ('create_date', 'id'), message_cursor)[:11]),
+        ('comments', Message.objects.filter(
+            parent=message.id, message_type=COMMENT).order_by('create_date')),
+        ('likes', Message.objects.filter(
+            parent=message.id, message_type=LIKE).order_by('-create_date')),
+        ('like exists', Message.objects.filter(
+            parent=message.id, message_type=LIKE, from_user=friend)),
+        ]
+        
+def plan_stages(plan):
+    stages = set([plan.get('stage')])
+    for child in [plan.get('inputStage')] + plan.get('inputStages', []):
+        if child:
+            stages |= plan_stages(child)
+    return stages
+    
+def explain_stages(queryset):
+    explain = queryset.explain()
+    if 'queryPlanner' in explain:
+        return plan_stages(explain['queryPlanner']['winningPlan'])
+        
+    # MongoDB 2.x explain format
+    stages = set()
+    for clause in [explain] + explain.get('clauses', []):
+        if clause.get('cursor', '').startswith('BasicCursor'):
+            stages.add('COLLSCAN')
+        if clause.get('scanAndOrder'):
+            stages.add('SORT')
+    return stages
+    
+def check_query_plans():
+    # returns (name, bad stages) for every query the indexes don't fully serve
+    results = []
+    for (name, queryset) in canonical_queries():
+        results.append((name, explain_stages(queryset) & set(['COLLSCAN', 'SORT'])))
+    return results
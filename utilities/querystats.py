@@ -0,0 +1,193 @@
+import json
+import time
+from collections import OrderedDict
+from flask import current_app, g, request, has_request_context
+from pymongo.collection import Collection
+from pymongo.cursor import Cursor
+from pymongo.database import Database
+
+try:
+    from pymongo import monitoring
+except ImportError:
+    monitoring = None
+    
+try:
+    from pymongo.bulk import BulkOperationBuilder
+except ImportError:
+    BulkOperationBuilder = None
+
+def shape(value):
+    # keep the keys and operators of a filter, drop the values
+    if isinstance(value, dict):
+        return OrderedDict((key, shape(value[key])) for key in sorted(value))
+    if isinstance(value, (list, tuple)):
+        if value and isinstance(value[0], dict):
+            return [shape(value[0])]
+        return '[?]'
+    return '?'
+
+def command_filter(name, command):
+    if name in ('find', 'count', 'distinct'):
+        return command.get('filter', command.get('query'))
+    if name == 'findAndModify':
+        return command.get('query')
+    if name in ('update', 'delete'):
+        ops = command.get('updates') or command.get('deletes') or [{}]
+        return ops[0].get('q')
+    if name == 'aggregate':
+        pipeline = command.get('pipeline') or [{}]
+        return pipeline[0].get('$match')
+    return None
+
+class QueryStats(object):
+    def __init__(self, repeat_threshold):
+        self.repeat_threshold = repeat_threshold
+        self.count = 0
+        self.elapsed_ms = 0.0
+        self.collections = {}
+        self.shapes = OrderedDict()
+        self.pending = {}
+        self.nested = 0
+
+    def record(self, name, collection, filter, elapsed_ms):
+        self.count += 1
+        self.elapsed_ms += elapsed_ms
+        self.collections[collection] = self.collections.get(collection, 0) + 1
+        key = '%s %s %s' % (name, collection, json.dumps(shape(filter)) if filter else '')
+        (count, total_ms) = self.shapes.get(key, (0, 0.0))
+        self.shapes[key] = (count + 1, total_ms + elapsed_ms)
+
+    def repeated(self):
+        # the same shape run over and over in one request is usually a query in a loop
+        return [(key, count, total_ms) for (key, (count, total_ms)) in self.shapes.items()
+            if count >= self.repeat_threshold]
+
+    def summary(self):
+        return {
+            'queries': self.count,
+            'ms': round(self.elapsed_ms, 2),
+            'collections': self.collections,
+            'repeated': [{'shape': key, 'count': count, 'ms': round(total_ms, 2)}
+                for (key, count, total_ms) in self.repeated()],
+            }
+
+def current_stats():
+    if has_request_context():
+        return getattr(g, 'query_stats', None)
+    return None
+
+if monitoring:
+    class QueryListener(monitoring.CommandListener):
+        # started and finished events for a command arrive on the requesting thread
+        def started(self, event):
+            stats = current_stats()
+            if stats is not None and event.command_name not in ('getMore', 'endSessions'):
+                collection = event.command.get(event.command_name)
+                stats.pending[event.request_id] = (event.command_name,
+                    collection if isinstance(collection, str) else event.database_name,
+                    command_filter(event.command_name, event.command))
+
+        def succeeded(self, event):
+            self.finished(event)
+
+        def failed(self, event):
+            self.finished(event)
+
+        def finished(self, event):
+            stats = current_stats()
+            if stats is not None:
+                pending = stats.pending.pop(event.request_id, None)
+                if pending:
+                    stats.record(*(pending + (event.duration_micros / 1000.0,)))
+
+def timed(name, collection, filter, method, *args, **kwargs):
+    # calls made inside a wrapped call, like a bulk write on an old server, count as part of it
+    stats = current_stats()
+    if stats is None or stats.nested:
+        return method(*args, **kwargs)
+    start = time.time()
+    stats.nested += 1
+    try:
+        return method(*args, **kwargs)
+    finally:
+        stats.nested -= 1
+        stats.record(name, collection, filter, (time.time() - start) * 1000)
+
+def patch_pymongo():
+    # pymongo before 3.1 has no command monitoring, so wrap the calls the app makes
+    refresh = Cursor._refresh
+    def cursor_refresh(self):
+        if self._Cursor__id is not None:
+            return refresh(self)
+        return timed('find', self._Cursor__collection.name, self._Cursor__spec, refresh, self)
+    Cursor._refresh = cursor_refresh
+
+    command = Database.command
+    def database_command(self, cmd, value=1, *args, **kwargs):
+        if isinstance(cmd, str):
+            name = cmd
+            params = dict(kwargs)
+            collection = value if isinstance(value, str) else self.name
+        else:
+            name = next(iter(cmd))
+            params = cmd
+            collection = cmd[name] if isinstance(cmd[name], str) else self.name
+        return timed(name, collection, command_filter(name, params),
+            command, self, cmd, value, *args, **kwargs)
+    Database.command = database_command
+
+    for (method_name, name, filter_arg) in (('insert', 'insert', None), ('update', 'update', 0), ('remove', 'delete', 0)):
+        def wrap(method, name, filter_arg):
+            def collection_method(self, *args, **kwargs):
+                filter = args[filter_arg] if filter_arg is not None and args else None
+                return timed(name, self.name, filter if isinstance(filter, dict) else None,
+                    method, self, *args, **kwargs)
+            return collection_method
+        setattr(Collection, method_name, wrap(getattr(Collection, method_name), name, filter_arg))
+        
+    # fan-out and feed bucket writes go through bulk operations, one execute per batch
+    if BulkOperationBuilder is None:
+        return
+    execute = BulkOperationBuilder.execute
+    def bulk_execute(self, *args, **kwargs):
+        bulk = self._BulkOperationBuilder__bulk
+        first = bulk.ops[0][1] if bulk.ops else None
+        filter = first.get('q') if isinstance(first, dict) else None
+        return timed('bulk', bulk.collection.name, filter, execute, self, *args, **kwargs)
+    BulkOperationBuilder.execute = bulk_execute
+
+class QueryInstrumentation(object):
+    def __init__(self):
+        self.installed = False
+
+    def init_app(self, app):
+        # must run before the mongo connection is made so the listener is attached to it
+        if not self.installed:
+            if monitoring:
+                monitoring.register(QueryListener())
+            else:
+                patch_pymongo()
+            self.installed = True
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def before_request(self):
+        g.query_stats = QueryStats(current_app.config.get('QUERY_STATS_REPEAT_THRESHOLD', 5))
+
+    def after_request(self, response):
+        stats = getattr(g, 'query_stats', None)
+        if stats is None:
+            return response
+        g.query_stats = None
+        summary = stats.summary()
+        response.headers['X-Mongo-Queries'] = '%d; %.2fms; %d repeated' % (
+            summary['queries'], summary['ms'], len(summary['repeated']))
+        summary['endpoint'] = request.endpoint
+        summary['path'] = request.path
+        if summary['repeated']:
+            current_app.logger.warning("mongo queries %s", json.dumps(summary, sort_keys=True))
+        else:
+            current_app.logger.info("mongo queries %s", json.dumps(summary, sort_keys=True))
+        return response
+
+query_instrumentation = QueryInstrumentation()
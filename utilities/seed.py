@@ -0,0 +1,147 @@
+import bisect
+import random
+import time
+from bson.objectid import ObjectId
+
+from user.models import User
+from relationship.models import Relationship
+from feed.models import Message, Feed, POST, COMMENT, LIKE, RECENT_LIKERS, TEXT_HTML_VERSION, like_key
+from user.passwords import passwords
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+    'incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud').split()
+
+class BulkWriter(object):
+    # buffers raw documents per collection and inserts them in large unordered batches
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.buffers = {}
+        self.counts = {}
+
+    def add(self, document, raw):
+        buffer = self.buffers.setdefault(document, [])
+        buffer.append(raw)
+        if len(buffer) >= self.batch_size:
+            self.flush(document)
+
+    def flush(self, document=None):
+        for document in ([document] if document else list(self.buffers)):
+            buffer = self.buffers.get(document)
+            if buffer:
+                # unordered so one batch is one round trip; a failed insert raises
+                # with the write errors rather than being skipped
+                bulk = document._get_collection().initialize_unordered_bulk_op()
+                for raw in buffer:
+                    bulk.insert(raw)
+                result = bulk.execute()
+                self.counts[document.__name__] = self.counts.get(document.__name__, 0) + result['nInserted']
+                self.buffers[document] = []
+
+class IdSequence(object):
+    # ObjectIds from (timestamp, counter) so the same seed always produces the same ids
+    def __init__(self):
+        self.counter = 0
+
+    def next(self, ts_ms):
+        self.counter += 1
+        return ObjectId('%08x%016x' % (ts_ms // 1000, self.counter))
+
+def power_law_graph(rng, users, avg_friends, alpha):
+    # Chung-Lu style: each user gets a pareto weight and edge ends are drawn in
+    # proportion to it, so a few users end up with many friends and most with few
+    weights = [rng.paretovariate(alpha) for i in range(users)]
+    cumulative = []
+    total = 0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    edges = set()
+    target = users * avg_friends // 2
+    attempts = 0
+    while len(edges) < target and attempts < target * 4:
+        attempts += 1
+        u = bisect.bisect_left(cumulative, rng.random() * total)
+        v = bisect.bisect_left(cumulative, rng.random() * total)
+        if u != v:
+            edges.add((u, v) if u < v else (v, u))
+    friends = [[] for i in range(users)]
+    for (u, v) in sorted(edges):
+        friends[u].append(v)
+        friends[v].append(u)
+    return friends
+
+def text(rng, low, high):
+    return ' '.join(rng.choice(WORDS) for i in range(rng.randint(low, high))).capitalize()
+
+def seed_dataset(users=1000, avg_friends=20, alpha=1.5, posts=5, comments=2, likes=3,
+        blocks=0.01, fanout_threshold=None, days=30, seed=1, batch_size=10000, now_ms=None):
+    rng = random.Random(seed)
+    ids = IdSequence()
+    writer = BulkWriter(batch_size)
+    now_ms = now_ms or int(time.time() * 1000)
+    start_ms = now_ms - days * 86400000
+    password = passwords.hash('password')
+
+    # users, carrying their friend ids and counts
+    created = [start_ms - rng.randint(0, 365) * 86400000 for i in range(users)]
+    user_ids = [ids.next(created_ms) for created_ms in created]
+    friends = power_law_graph(rng, users, avg_friends, alpha)
+    for i in range(users):
+        writer.add(User, {'_id': user_ids[i], 'u': 'user%d' % i, 'e': 'user%d@example.com' % i, 'p': password,
+            'fn': 'User', 'ln': str(i), 'c': created[i] // 1000, 'ecf': True,
+            'fi': [user_ids[v] for v in friends[i]], 'fc': len(friends[i])})
+
+    # friendships, stored as the two approved rows the add_friend view writes
+    for u in range(users):
+        for v in friends[u]:
+            req_date = rng.randint(start_ms, now_ms) // 1000
+            writer.add(Relationship, {'_id': ids.next(req_date * 1000), 'fu': user_ids[u], 'tu': user_ids[v],
+                'rt': Relationship.FRIENDS, 's': Relationship.APPROVED, 'rd': req_date, 'ad': req_date})
+
+    # blocks between users who aren't friends
+    blocked_by = [set() for i in range(users)]
+    for i in range(int(users * blocks)):
+        u = rng.randrange(users)
+        v = rng.randrange(users)
+        if u != v and v not in friends[u] and v not in blocked_by[u]:
+            blocked_by[u].add(v)
+            req_date = rng.randint(start_ms, now_ms) // 1000
+            writer.add(Relationship, {'_id': ids.next(req_date * 1000), 'fu': user_ids[u], 'tu': user_ids[v],
+                'rt': Relationship.BLOCKED, 's': Relationship.APPROVED, 'rd': req_date, 'ad': 0})
+
+    # posts with comments and likes from the author's friends, and the pushed feed entries
+    high_fanout = []
+    for u in range(users):
+        push = fanout_threshold is None or len(friends[u]) <= fanout_threshold
+        if not push:
+            high_fanout.append(user_ids[u])
+        for p in range(rng.randint(0, posts * 2)):
+            create_date = rng.randint(start_ms, now_ms)
+            message_id = ids.next(create_date)
+            post_text = text(rng, 5, 30)
+            commenters = [rng.choice(friends[u]) for i in range(rng.randint(0, comments * 2))] if friends[u] else []
+            likers = rng.sample(friends[u], min(len(friends[u]), rng.randint(0, likes * 2)))
+            liker_dates = sorted((rng.randint(create_date, now_ms), v) for v in likers)
+            for v in commenters:
+                comment_date = rng.randint(create_date, now_ms)
+                comment_text = text(rng, 3, 15)
+                writer.add(Message, {'_id': ids.next(comment_date), 'fu': user_ids[v], 't': comment_text,
+                    'th': comment_text, 'thv': TEXT_HTML_VERSION, 'mt': COMMENT, 'p': message_id, 'c': comment_date,
+                    'cc': 0, 'lc': 0, 'rl': [], 'v': 0})
+            for (like_date, v) in liker_dates:
+                writer.add(Message, {'_id': ids.next(like_date), 'fu': user_ids[v], 'tu': user_ids[u],
+                    'mt': LIKE, 'p': message_id, 'lk': like_key(message_id, user_ids[v]), 'c': like_date,
+                    'cc': 0, 'lc': 0, 'rl': [], 'v': 0})
+            writer.add(Message, {'_id': message_id, 'fu': user_ids[u], 't': post_text, 'th': post_text,
+                'thv': TEXT_HTML_VERSION, 'mt': POST, 'c': create_date, 'cc': len(commenters),
+                'lc': len(likers), 'rl': [user_ids[v] for (like_date, v) in reversed(liker_dates)][:RECENT_LIKERS],
+                'v': 0})
+            writer.add(Feed, {'_id': ids.next(create_date), 'u': user_ids[u], 'm': message_id, 'c': create_date})
+            if push:
+                for v in friends[u]:
+                    writer.add(Feed, {'_id': ids.next(create_date), 'u': user_ids[v], 'm': message_id,
+                        'c': create_date})
+    writer.flush()
+    if high_fanout:
+        User._get_collection().update({'_id': {'$in': high_fanout}}, {'$set': {'hf': True}}, multi=True)
+    return writer.counts
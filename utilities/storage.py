@@ -0,0 +1,58 @@
+import os
+import boto3
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+
+class LocalBackend(object):
+    def __init__(self, root):
+        self.root = root
+        
+    def put(self, key, data, content_type):
+        path = os.path.join(self.root, key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+            
+class S3Backend(object):
+    # one client for the whole process, its connection pool sized for the uploaders
+    def __init__(self, bucket, max_connections):
+        self.bucket = bucket
+        self.client = boto3.client('s3', config=Config(max_pool_connections=max_connections))
+        
+    def put(self, key, data, content_type):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=data,
+            ACL='public-read',
+            ContentType=content_type
+            )
+            
+class Storage(object):
+    def __init__(self):
+        self.backend = None
+        self.executor = None
+        
+    def init_app(self, app):
+        workers = app.config.get('STORAGE_WORKERS', 8)
+        if app.config.get('AWS_BUCKET') and app.config.get('STORAGE_BACKEND', 's3') == 's3':
+            backend = S3Backend(app.config.get('AWS_BUCKET'), workers)
+        else:
+            backend = LocalBackend(app.config.get('STORAGE_ROOT') or app.config.get('UPLOAD_FOLDER'))
+        self.configure(backend, workers)
+        
+    def configure(self, backend, workers=8):
+        if self.executor:
+            self.executor.shutdown(wait=False)
+        self.backend = backend
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        
+    def put_many(self, items):
+        # upload (key, data, content_type) items concurrently and wait for all of them
+        futures = [self.executor.submit(self.backend.put, key, data, content_type)
+            for (key, data, content_type) in items]
+        for future in futures:
+            future.result()
+            
+storage = Storage()